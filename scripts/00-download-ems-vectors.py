@@ -1,14 +1,18 @@
 # Import modules
 import os
 import json
-import ee
-import pickle
-import re
 import logging
+import pandas as pd
 import geopandas as gpd
 
-from utils import gee_utils as gee_helpers
 from utils import utils as helpers
+from utils import download_utils as download_helpers
+from utils import http_cache
+from utils import product_index as index_helpers
+from utils import floodmap_store
+from utils import vector_utils as vector_helpers
+from utils import country_utils as country_helpers
+from utils import catalog_utils as catalog_helpers
 from ml4floods.data.copernicusEMS import activations
 from ml4floods.data import utils
 from ml4floods.data import create_gt
@@ -33,194 +37,244 @@ os.makedirs(folder_out_ems, exist_ok=True)
 folder_out = os.path.join(os.getcwd(), "source-data", "Copernicus_EMS_raw")
 os.makedirs(folder_out, exist_ok=True)
 
-# Folder to store metadata for each tropical and sub-tropical
-# EMS Flood and Storm event
+# Folder to store the catalog of vector products of tropical
+# and sub-tropical EMS Flood and Storm events
 folder_metadata = os.path.join(os.getcwd(), "source-data", "Copernicus_EMS_metadata")
 os.makedirs(folder_metadata, exist_ok=True)
 
+# GeoParquet store of floodmaps and metadata for each tropical and
+# sub-tropical EMS Flood and Storm event, partitioned by EMSR code
+folder_store = os.path.join(os.getcwd(), "source-data", "Copernicus_EMS_floodmaps")
+os.makedirs(folder_store, exist_ok=True)
 
-#----------------------------------------------------------
-# Set up a logger.
-#----------------------------------------------------------
-
-# Create a custom logger
-logger = logging.getLogger("00-download-ems-vectors")
-logger.setLevel(logging.DEBUG)
 
-# Create handlers
-f_handler = logging.FileHandler("00-download-ems-vectors.log")
-f_handler.setLevel(logging.DEBUG)
+# Sync mode, one of:
+#   full: process every tropical EMSR code
+#   incremental: process only EMSR codes that are new or changed since
+#   the last fetched activations table saved in ems_activations.csv
+sync_mode = "incremental"
 
-# Create formatters and add it to handlers
-f_format = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-f_handler.setFormatter(f_format)
+# Number of concurrent downloads in total and per host
+download_workers = 8
+download_workers_per_host = 4
 
-# Add handlers to the logger
-logger.addHandler(f_handler)
+# Extract the downloaded zip files. If False, vector products
+# are read directly inside the zip files through GDAL's /vsizip/.
+extract_zips = False
 
+# Skip vector products whose AOI polygon is outside the tropics
+filter_aoi_tropics = False
 
-#------------------------------------------------------------
-# Create a dataframe of EMS activations in tropical countries
-# and save it as a CSV file in Copernicus_EMS_table folder
-#------------------------------------------------------------
+# Number of processes generating metadata and floodmaps
+# (1 to process vector products in this process)
+vector_workers = os.cpu_count()
 
-# Get a table of EMS activations since user specified date
-table_activations_ems = helpers.table_floods_ems()
 
-# Get a list of countries
-countries = table_activations_ems["Country"].unique()
-countries_split = []
+if __name__ == "__main__":
 
-for i in countries:
-    split = i.split(",")
-    for s in split:
-        s = s.strip()
-        countries_split.append(s)
+    #----------------------------------------------------------
+    # Set up a logger.
+    #----------------------------------------------------------
 
-# Extract tropical countries from the list of countries
-tropical_countries = gee_helpers.get_tropical_countries(countries_split)
+    # Create a custom logger
+    logger = logging.getLogger("00-download-ems-vectors")
+    logger.setLevel(logging.DEBUG)
 
-# Get a table of EMS activations in tropical countries
-tropical_ems = table_activations_ems[
-    table_activations_ems["Country"].isin(tropical_countries)
-].reset_index()
+    # Create handlers
+    f_handler = logging.FileHandler("00-download-ems-vectors.log")
+    f_handler.setLevel(logging.DEBUG)
 
-# Save tropical EMS DataFrame into a CSV file
-tropical_ems.to_csv(os.path.join(folder_out_ems, "tropical_ems.csv"))
+    # Create formatters and add it to handlers
+    f_format = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    f_handler.setFormatter(f_format)
 
+    # Add handlers to the logger
+    logger.addHandler(f_handler)
 
-#------------------------------------------------
-# Download the latest EMSR vector products for 
-# each EMS flood event. Generate metadata and 
-# flood maps from the downloaded vector products.
-#------------------------------------------------
+    # Log messages from the helper modules to the same file
+    utils_logger = logging.getLogger("utils")
+    utils_logger.setLevel(logging.DEBUG)
+    utils_logger.addHandler(f_handler)
 
-# Get a list of EMSR (EMS Rapid Mapping) codes for flood events in tropical countries
-tropical_emsr_codes = tropical_ems["Code"].tolist()
-logger.info(f"tropical EMSR codes {tropical_emsr_codes}")
 
-# Retrieve a url for each EMSR code, download the zip files
-# associated with the code, then unzip the files.
-for i in tropical_emsr_codes:
-    logger.info(f"Trying EMSR CODE {i}")
+    #------------------------------------------------------------
+    # Create one pooled HTTP session for all requests. Set the
+    # HTTP_CACHE_MODE environment variable to "record" to save
+    # responses to a local store or "replay" to run offline.
+    #------------------------------------------------------------
 
-    zip_files_activation_url_list = activations.fetch_zip_file_urls(i)
-
-    unzip_files_activation = []
-    for zip_file in zip_files_activation_url_list:
-        try:
-            local_zip_file = activations.download_vector_cems(
-                zip_file, folder_out=folder_out
-            )
-            unzipped_file = activations.unzip_copernicus_ems(
-                local_zip_file, folder_out=folder_out
+    http_session = http_cache.make_session(pool_maxsize=download_workers)
+
+
+    #------------------------------------------------------------
+    # Create a dataframe of EMS activations in tropical countries
+    # and save it as a CSV file in Copernicus_EMS_table folder
+    #------------------------------------------------------------
+
+    # Get a table of EMS activations since user specified date,
+    # retrying if the request fails or times out
+    table_activations_ems = helpers.with_retries(
+        helpers.table_floods_ems, session=http_session
+    )
+
+    # Get a list of countries
+    countries = table_activations_ems["Country"].unique()
+    countries_split = []
+
+    for i in countries:
+        split = i.split(",")
+        for s in split:
+            s = s.strip()
+            countries_split.append(s)
+
+    # Download and cache the country boundaries from GEE on first use.
+    # Afterwards tropical countries are filtered offline.
+    if not os.path.exists(country_helpers.COUNTRY_BOUNDARIES_PATH):
+        from utils import gee_utils as gee_helpers
+
+        gee_helpers.download_country_boundaries(country_helpers.COUNTRY_BOUNDARIES_PATH)
+
+    # Extract tropical countries from the list of countries
+    tropical_countries = country_helpers.get_tropical_countries(countries_split)
+
+    # Get a table of EMS activations in tropical countries
+    tropical_ems = table_activations_ems[
+        table_activations_ems["Country"].isin(tropical_countries)
+    ].reset_index()
+
+    # Save tropical EMS DataFrame into a CSV file
+    tropical_ems.to_csv(os.path.join(folder_out_ems, "tropical_ems.csv"))
+
+
+    #------------------------------------------------------------
+    # Compare the table of EMS activations with the table saved
+    # by the last run. Only new and changed activations are
+    # downloaded and processed in incremental sync mode. The
+    # delta is saved for the export stage in ems_delta.csv.
+    #------------------------------------------------------------
+
+    activations_snapshot_path = os.path.join(folder_out_ems, "ems_activations.csv")
+    activations_delta_path = os.path.join(folder_out_ems, "ems_delta.csv")
+
+    tropical_codes = set(tropical_ems["Code"])
+
+    previous_activations = None
+    if sync_mode == "incremental" and os.path.exists(activations_snapshot_path):
+        previous_activations = pd.read_csv(activations_snapshot_path, index_col="Code")
+        activations_delta = helpers.diff_activations(previous_activations, table_activations_ems)
+
+        # Removed activations are kept in the delta even if no longer
+        # listed, so later stages know they are gone
+        activations_delta = activations_delta[
+            activations_delta.index.isin(tropical_codes)
+            | (activations_delta["Change"] == "removed")
+        ]
+    else:
+        activations_delta = pd.DataFrame(
+            {"Change": "new"}, index=pd.Index(sorted(tropical_codes), name="Code")
+        )
+
+    for change in ["new", "changed", "removed"]:
+        codes = activations_delta.index[activations_delta["Change"] == change].tolist()
+        logger.info(f"{len(codes)} {change} EMSR codes {codes}")
+
+    activations_delta.to_csv(activations_delta_path)
+
+
+    #------------------------------------------------
+    # Download the latest EMSR vector products for 
+    # each EMS flood event. Generate metadata and 
+    # flood maps from the downloaded vector products.
+    #------------------------------------------------
+
+    # Get a list of new and changed EMSR (EMS Rapid Mapping) codes
+    # for flood events in tropical countries
+    tropical_emsr_codes = [
+        c for c in tropical_ems["Code"].tolist()
+        if c in activations_delta.index and activations_delta.loc[c, "Change"] != "removed"
+    ]
+    logger.info(f"tropical EMSR codes {tropical_emsr_codes}")
+
+    # Retrieve a url for each EMSR code, download the zip files
+    # associated with the code, then unzip the files if requested.
+    # Downloads run concurrently and are journaled so an interrupted
+    # run resumes.
+    unzip_files_by_code, failed_codes = download_helpers.download_activations(
+        tropical_emsr_codes,
+        folder_out=folder_out,
+        journal_path=os.path.join(folder_out, "download_journal.jsonl"),
+        max_workers=download_workers,
+        max_per_host=download_workers_per_host,
+        session=http_session,
+        extract=extract_zips,
+        refresh_codes=set(activations_delta.index[activations_delta["Change"] == "changed"]),
+    )
+
+    # Unzipped vector products and their activation dates to process,
+    # and the EMSR code of each product
+    vector_jobs = []
+    vector_codes = {}
+
+    for i in tropical_emsr_codes:
+        logger.info(f"Trying EMSR CODE {i}")
+
+        unzip_files_activation = unzip_files_by_code[i]
+
+        # Get only the latest version of vector data - with the largest v* number
+        # because the latest version is the highest quality product.
+        # Process only the latest vector products.
+        unzip_files_activation = index_helpers.latest_versions(unzip_files_activation)
+        code_date = table_activations_ems.loc[i]["CodeDate"]
+
+        # Queue the latest vector products of the activation
+        for unzip_folder in unzip_files_activation:
+            vector_jobs.append((unzip_folder, code_date))
+            vector_codes[unzip_folder] = i
+
+    # Generate metadata and floodmaps for EMS activation events across
+    # a pool of processes. Each product is processed independently, so
+    # a failure only affects the product that caused it.
+    vector_results = vector_helpers.process_vector_products(
+        vector_jobs,
+        folder_store,
+        max_workers=vector_workers,
+        filter_tropics=filter_aoi_tropics,
+    )
+    for unzip_folder, status, error in vector_results:
+        if status == "processed":
+            logger.info(f"File {unzip_folder} processed correctly")
+        elif status == "outside_tropics":
+            logger.info(f"File {unzip_folder} has an AOI outside the tropics. It won't be processed")
+        elif status == "skipped":
+            logger.warning(
+                f"File {unzip_folder} does not follow the expected format. It won't be processed"
             )
-
-            # Filter out vector products, including 
-            # First Estimate Products (FEP),
-            # Delineation Products (DEP) 
-            # and Grading Products (GRA), to generate flood extent.
-            # The RTP products are the same but with a printable map
-            # The documentation describing each product can be found in the link below: https://emergency.copernicus.eu/mapping/sites/default/files/files/EMS_Mapping_Manual_of_Procedures_v2_September2020.pdf
-            if (
-                (re.search("FEP", zip_file))
-                or (re.search("DEL", zip_file))
-                or (re.search("DELINEATION", zip_file))
-                or (re.search("GRA", zip_file))
-                or (re.search("GRADING", zip_file))
-            ):
-                unzip_files_activation.append(unzipped_file)
-        except:
-            error_zip = str(zip_file)
-            logger.exception(f"{error_zip} caused an Exception")
-            continue
-
-    # Get only the latest version of vector data - with the largest v* number
-    # because the latest version is the highest quality product.
-    unzip_files_activation_latest_v = []
-
-    # Extract only the event names from the file names
-    unique_event_name = set()
-    for z in unzip_files_activation:
-        file_name = z.split("/")
-        split_count = len(file_name)
-        file_name = file_name[split_count - 1]
-        event_name = file_name.split("_r")[0]
-        unique_event_name.add(event_name)
-
-    # Extract all file paths that match each unique event name
-    for v in list(unique_event_name):
-        tmp_paths = []
-        for vv in unzip_files_activation:
-            if re.search(v, vv):
-                tmp_paths.append(vv)
-
-        # Extract the version number from the file paths
-        tmp_versions = []
-        for t in tmp_paths:
-            version = re.findall(r"_v\d_", t)[0]
-            version_number = re.findall(r"\d", version)[0]
-            tmp_versions.append(version_number)
-
-        # Locate the latest version of vector data and
-        # add it to the empty list created to store the
-        # latest version of unzipped files.
-        max_version = max(tmp_versions)
-        max_version_index = tmp_versions.index(max_version)
-
-        most_recent_ems_version = tmp_paths[max_version_index]
-        unzip_files_activation_latest_v.append(most_recent_ems_version)
-
-    # Process only the latest vector products
-    unzip_files_activation = unzip_files_activation_latest_v
-    code_date = table_activations_ems.loc[i]["CodeDate"]
-
-    # Generate metadata and floodmaps for EMS activation events
-    for unzip_folder in unzip_files_activation:
-        try:
-            # Check that all the .shp files follow the expected conventions 
-            # with respect to timestamp and data availability.
-            # Get AOI, hydrography, and observed event data from the zip file folder.
-            metadata_floodmap = activations.filter_register_copernicusems(
-                unzip_folder, code_date
-            )
-
-            # Process the .shp files' AOI, hydrography, and observed event
-            # into a single geopandas.GeoDataFrame object using generate_floodmap.
-            if metadata_floodmap is not None:
-                logger.info(f"File {unzip_folder} processed correctly")
-
-                # Combine floodmap and hydrography into one GeoDataFrame
-                floodmap = activations.generate_floodmap(
-                    metadata_floodmap, folder_files=unzip_folder
-                )
-
-                # Save ML4Flood metadata object
-                with open(
-                    os.path.join(
-                        folder_metadata,
-                        unzip_folder.split("/")[len((unzip_folder).split("/")) - 1]
-                        + ".pickle",
-                    ),
-                    "wb",
-                ) as f:
-                    pickle.dump(metadata_floodmap, f)
-
-                # Save floodmap as GeoJSON
-                floodmap.to_file(
-                    os.path.join(
-                        folder_metadata,
-                        unzip_folder.split("/")[len((unzip_folder).split("/")) - 1]
-                        + ".geojson",
-                    ),
-                    drive="GeoJSON",
-                )
-
-            else:
-                logger.warning(
-                    f"File {unzip_folder} does not follow the expected format. It won't be processed"
-                )
-        except:
-            logger.exception(f"Could not download {unzip_folder}")
-
-logger.info(f"**********finished**********")
\ No newline at end of file
+        else:
+            logger.error(f"Could not process {unzip_folder}\n{error}")
+            failed_codes.add(vector_codes[unzip_folder])
+
+    # Build the catalog of all vector products in the store, queried
+    # by the later stages instead of per-product metadata files
+    catalog_helpers.build_catalog(
+        folder_store, table_activations_ems, os.path.join(folder_metadata, "catalog.parquet")
+    )
+
+    # Save the table of EMS activations to compare against on the next run.
+    # EMSR codes that failed to download or process keep the row of the
+    # last snapshot, or no row if they are new, so the next run finds them
+    # changed or new again and retries them.
+    if failed_codes:
+        logger.warning(f"{len(failed_codes)} EMSR codes failed and will be retried {sorted(failed_codes)}")
+    activations_snapshot = table_activations_ems[
+        ~table_activations_ems.index.isin(failed_codes)
+    ]
+    if previous_activations is not None:
+        activations_snapshot = pd.concat(
+            [
+                activations_snapshot,
+                previous_activations[previous_activations.index.isin(failed_codes)],
+            ]
+        )
+    activations_snapshot.to_csv(activations_snapshot_path)
+
+    logger.info(f"**********finished**********")
\ No newline at end of file
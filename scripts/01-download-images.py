@@ -1,26 +1,61 @@
 # Import modules
 import os
 import json
-import ee
-import pickle
 import logging
 import geopandas as gpd
 import pandas as pd
 
-from utils import gee_utils as gee_helpers
+from functools import partial
+from utils import task_utils
+from utils import static_image_utils as static_helpers
+from utils import fingerprint_utils as fingerprint_helpers
+from utils import catalog_utils as catalog_helpers
 from shapely.geometry import mapping  # convert shapely geometry to GeoJSON
 
+# Engine used to build static images, one of:
+#   gee: export from Google Earth Engine to Google Cloud Storage
+#   local: build from local WorldCover and JRC tiles in static_tiles_dir
+static_image_engine = "gee"
+
+# Folder of local WorldCover (worldcover/) and JRC (jrc/<year>/) tiles
+# and folder to save static images built locally
+static_tiles_dir = os.path.join(os.getcwd(), "source-data", "static-tiles")
+static_images_path = os.path.join(os.getcwd(), "source-data", "static-images")
+
 # Name Google Cloud Storage Bucket to save static images
 # from Google Earth Engine (GEE)
 gcs_bucket = "ccai-flood-ground-truth"
 
+# Maximum number of GEE export tasks running at once and
+# seconds between polls of their status
+max_exports_in_flight = 10
+export_poll_interval = 60
+
+# Export only the static images of EMSR codes that are new or changed
+# in ems_delta.csv, saved by 00-download-ems-vectors.py
+export_delta_only = True
+
+if static_image_engine == "gee":
+    import ee
+    from utils import gee_utils as gee_helpers
+
+    # Module used to create export tasks. Use task_utils.LocalBatch()
+    # to run the export scheduler offline without Earth Engine.
+    export_batch = ee.batch
+
+    # Function getting the status of an export task from its id, used to
+    # poll tasks left running by a previous run. Use the task_status
+    # method of the LocalBatch offline.
+    def export_task_status(task_id):
+        return ee.data.getTaskStatus(task_id)[0]
+
 
 # -------------------------------------------
 # Create paths to access data downloaded from 
 # Script 00-download-ems-vectors
 # -------------------------------------------
 
-# Path to EMS activations metadata
+# Path to the catalog of EMS vector products
 folder_metadata = os.path.join(os.getcwd(), "source-data", "Copernicus_EMS_metadata")
 
 # Path to CSV file of EMS activations
@@ -57,47 +92,117 @@ logger.addHandler(f_handler)
 # Read in the table of EMS activations
 ems_table = pd.read_csv(os.path.join(folder_out_ems, "tropical_ems.csv"))
 
-# Get EMS activation metadata pickle files
-metadata_files = os.listdir(folder_metadata)
-metadata_files_pickle = []
-for i in metadata_files:
-    if i.endswith(".pickle"):
-        metadata_files_pickle.append(i)
-
-# Loop over EMS activation metadata pickle files
+# Get the EMSR codes to export static images for and the changed
+# EMSR codes whose static images are exported again
+export_codes = set(ems_table["Code"])
+changed_codes = set()
+delta_path = os.path.join(folder_out_ems, "ems_delta.csv")
+if export_delta_only and os.path.exists(delta_path):
+    ems_delta = pd.read_csv(delta_path)
+    export_codes = set(ems_delta.loc[ems_delta["Change"] != "removed", "Code"])
+    changed_codes = set(ems_delta.loc[ems_delta["Change"] == "changed", "Code"])
+
+# Get the event id, EMSR code, activation date and AOI polygon
+# of each vector product from the catalog
+catalog = catalog_helpers.read_catalog(
+    os.path.join(folder_metadata, "catalog.parquet"),
+    columns=["name", "ems_code", "activation_date", "geometry"],
+)
+
+# Schedule exports with a bounded number of tasks in flight. The state
+# of each export is saved so completed exports are skipped on reruns.
+scheduler = task_utils.ExportScheduler(
+    os.path.join(folder_metadata, "export_tasks.json"),
+    max_in_flight=max_exports_in_flight,
+    poll_interval=export_poll_interval,
+    task_status=export_task_status if static_image_engine == "gee" else None,
+)
+
+# Products of the same EMSR code and AOI share one footprint. Export one
+# static image per AOI fingerprint and map the other products to it.
+# Static images whose export failed in a previous run are not shared, so
+# another product with the same footprint is exported instead.
+shared_static_images = fingerprint_helpers.SharedStaticImages(
+    failed={
+        name
+        for name, state in scheduler.state.items()
+        if state.get("state") in (task_utils.FAILED, task_utils.CANCELLED)
+    }
+)
+
+# Index the footprints of the local tiles to build static images from
+if static_image_engine == "local":
+    os.makedirs(static_images_path, exist_ok=True)
+    tile_index = static_helpers.build_tile_index(
+        static_tiles_dir, os.path.join(static_tiles_dir, "tile_index.parquet")
+    )
+
+
+def static_image_available(name):
+    """
+    Check if the static image of a product was exported to the bucket
+    or built locally.
+    """
+    if static_image_engine == "local":
+        return os.path.exists(os.path.join(static_images_path, name + ".tif"))
+    return scheduler.state.get(name, {}).get("state") == task_utils.COMPLETED
+
+# Loop over the vector products in the catalog
 # and download static images from GEE.
 # Adapted from https://github.com/spaceml-org/ml4floods/blob/main/ml4floods/data/copernicusEMS/activations.py
-for i in metadata_files_pickle:
+for product in catalog.sort_values("name").itertuples(index=False):
+    i = product.name
     logger.info(f"Trying EMS activation {i}")
 
     try:
-        # Create a path to individual metadata pickle files
-        fpath = os.path.join(folder_metadata, i)
+        # Extract the year of the event
+        event_id = product.ems_code
+        year = product.activation_date.year
+        aoi_polygon = product.geometry
+        
+        # Extract the name of the event
+        event_name = product.event_id
+        export_fname = event_name + "_static_images"
 
-        # Read metadata pickle files to obtain the AOI object, 
-        # the year, and the name of the event
-        with open(fpath, "rb") as f:
-            metadata_floodmap = pickle.load(f)
+        # Skip products whose static image is already exported for another
+        # product with the same AOI polygon and JRC year.
+        shared_fname = shared_static_images.assign(
+            export_fname, aoi_polygon, int(year)
+        )
+        if shared_fname != export_fname:
+            logger.info(f"EMS activation {i} shares static images {shared_fname}")
+            continue
+
+        # Fingerprints are assigned for every product above so the mapping
+        # stays complete, but only new and changed activations, and static
+        # images whose export did not complete, are exported
+        if event_id not in export_codes and static_image_available(export_fname):
+            logger.info(f"EMS activation {i} unchanged since the last sync, skipping")
+            continue
+
+        # Build static images from local tiles into the static images folder,
+        # named like the GEE exports so later stages are unchanged.
+        if static_image_engine == "local":
+            static_helpers.build_static_image(
+                aoi_polygon,
+                int(year),
+                tile_index,
+                os.path.join(static_images_path, export_fname + ".tif"),
+            )
+            logger.info(f"Static images built locally for EMS activation {i}")
+            continue
 
         # Convert Shapely polygon object defining AOI of each 
         # activation into an Earth Engine "ee.geometry" object, 
         # which will be used to export static images from GEE.
-        ee_poly = ee.Geometry(mapping(metadata_floodmap["area_of_interest_polygon"]))
-        
-        # Extract the year of the event
-        event_id = metadata_floodmap["event id"].split("_")[0]
-        event_record = ems_table.loc[ems_table["Code"] == event_id, ["CodeDate"]]
-        year = event_record.to_numpy()[0][0].split("-")[0]
-        
-        # Extract the name of the event
-        event_name = metadata_floodmap["event id"]
+        ee_poly = ee.Geometry(mapping(aoi_polygon))
 
         # Get static images of permanent water from JRC and land cover from ESA
         static_images = gee_helpers.get_static_images(int(year), ee_poly)
-        export_fname = event_name + "_static_images"
 
-        # Export the static images into Google Cloud Storage Bucket
-        task = ee.batch.Export.image.toCloudStorage(
+        # Queue the export of the static images into Google Cloud Storage Bucket
+        create_task = partial(
+            export_batch.Export.image.toCloudStorage,
             static_images.clip(ee_poly),
             fileNamePrefix=export_fname,
             description=export_fname,
@@ -107,11 +212,28 @@ for i in metadata_files_pickle:
             scale=10,
             maxPixels=1e13,
         )
-        task.start()
-        logger.info(f"Download static images task started for EMS activation {i}")
+        if scheduler.submit(export_fname, create_task, rerun=event_id in changed_codes):
+            logger.info(f"Download static images task queued for EMS activation {i}")
         
     except:
         logger.warning(f"Failed to generate static images for EMS activation {i}")
         continue
 
+# Run the export tasks and wait for them to finish
+export_states = scheduler.run()
+for export_fname, state in export_states.items():
+    if state != task_utils.COMPLETED:
+        logger.warning(f"Export {export_fname} finished with state {state}")
+
+# Save the mapping of products to shared static images, used in
+# 03-merge-images.py to give each product its image. Products are only
+# mapped to static images that were exported, so products sharing a
+# failed export are exported on the next run.
+shared_static_images.to_csv(
+    os.path.join(folder_metadata, "static_images_fingerprints.csv"),
+    available={
+        name for name, _ in shared_static_images.records if static_image_available(name)
+    },
+)
+
 logger.info(f"**********finished**********")
\ No newline at end of file
@@ -1,9 +1,12 @@
 # Import modules
-import requests
 import os
 import pandas as pd
 import logging
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import http_cache
+from utils.utils import with_retries
 
 # Create a path to CSV file of EMS activations table
 # and read in as a DataFrame.
@@ -17,6 +20,51 @@ ems_event_url = "https://emergency.copernicus.eu/mapping/list-of-components/"
 # Copy the DataFrame of events to append event dates
 ems_df_out = ems_df.copy()
 
+# Path to CSV file of EMS activations with event dates. Event dates
+# already in this file are reused instead of scraped again.
+event_date_csv = os.path.join(folder_csv_ems, "tropical_ems_event_date.csv")
+
+# Number of event pages fetched concurrently
+event_date_workers = 8
+
+# Timeout in seconds for connecting to and reading an event page. A
+# page that times out is retried like other request errors.
+event_date_timeout = 60
+event_date_retries = 3
+
+# Create a pooled HTTP session. Set the HTTP_CACHE_MODE environment
+# variable to "record" or "replay" to record or replay responses.
+http_session = http_cache.make_session(pool_maxsize=event_date_workers)
+
+# Only parse the span holding the event date in each page
+event_time_strainer = SoupStrainer("span", class_="views-field-field-event-time-utc")
+
+
+def parse_event_date(content):
+    """
+    Get the event date from the HTML of an EMS event info page.
+
+    Args:
+        content (bytes): HTML of the page.
+
+    Returns:
+        str: Event date as YYYY-MM-DD, or None if the page has no event date.
+    """
+    soup = BeautifulSoup(content, "lxml", parse_only=event_time_strainer)
+    utc_date = soup.find("span", class_="date-display-single")
+    if utc_date is None or not utc_date.get("content"):
+        return None
+    return utc_date["content"].split("T")[0]
+
+
+def get_event_date(ems_code):
+    """
+    Scrape the event date of an EMSR code from its event info page.
+    """
+    r = http_session.get(ems_event_url + ems_code, timeout=event_date_timeout)
+    r.raise_for_status()
+    return parse_event_date(r.content)
+
 
 #----------------------------------------------------------
 # Set up a logger.
@@ -46,32 +94,43 @@ logger.addHandler(f_handler)
 # with the actual event date.
 # ------------------------------------------------------------------
 
-# Loop over EMS events and scrape event dates from the URL
-for i in ems_df.index:
-    try:
-        ems_code = ems_df["Code"][i]
-        logger.info(f"Trying EMS activation {i}")
-        url = ems_event_url + ems_code
-
-        # Get event date from webpage HTML
-        r = requests.get(url)
-        soup = BeautifulSoup(r.content, "html.parser")
-        utc = soup.find_all("span", class_="views-field-field-event-time-utc")
-        soup_2 = BeautifulSoup(str(utc), "html.parser")
-        utc_date = soup_2.find_all("span", class_="date-display-single")
-        utc_date = str(utc_date)
-        if len(utc_date) > 0:
-            utc_date = utc_date.split('content="')[1]
-            utc_date = utc_date.split("T")[0]
-
-        ems_df_out.loc[i, "EventDate"] = utc_date
-    except:
-        logger.warning(
-            f'Failed to get event date for EMS activation {ems_df["Code"][i]}'
-        )
-        continue
+# Get the event dates scraped in previous runs
+event_date_cache = {}
+if os.path.exists(event_date_csv):
+    cached = pd.read_csv(event_date_csv).dropna(subset=["EventDate"])
+    event_date_cache = dict(zip(cached["Code"], cached["EventDate"]))
+
+# Scrape the event dates of activations that changed since the last sync again
+delta_path = os.path.join(folder_csv_ems, "ems_delta.csv")
+if os.path.exists(delta_path):
+    ems_delta = pd.read_csv(delta_path)
+    for ems_code in ems_delta.loc[ems_delta["Change"] == "changed", "Code"]:
+        event_date_cache.pop(ems_code, None)
+
+# Scrape event dates of the EMS events missing from the cache concurrently
+missing_codes = [c for c in ems_df["Code"].unique() if c not in event_date_cache]
+logger.info(f"Reusing {len(event_date_cache)} cached event dates, fetching {len(missing_codes)}")
+
+with ThreadPoolExecutor(max_workers=event_date_workers) as pool:
+    futures = {
+        c: pool.submit(with_retries, get_event_date, c, retries=event_date_retries)
+        for c in missing_codes
+    }
+    for ems_code, future in futures.items():
+        logger.info(f"Trying EMS activation {ems_code}")
+        try:
+            utc_date = future.result()
+        except Exception as e:
+            logger.warning(f"Failed to get event date for EMS activation {ems_code}: {e!r}")
+            continue
+        if utc_date is None:
+            logger.warning(f"Failed to get event date for EMS activation {ems_code}")
+            continue
+        event_date_cache[ems_code] = utc_date
+
+ems_df_out["EventDate"] = ems_df_out["Code"].map(event_date_cache)
 
 # Save DataFrame with EMS event dates to a CSV file
-ems_df_out.to_csv(os.path.join(folder_csv_ems, "tropical_ems_event_date.csv"), index=False)
+ems_df_out.to_csv(event_date_csv, index=False)
 
 logger.info(f"**********finished**********")
\ No newline at end of file
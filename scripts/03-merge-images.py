@@ -1,10 +1,14 @@
 # Import modules
 import os
-import pickle
-import shutil
 import logging
 import pandas as pd
 
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from utils import product_index as index_helpers
+from utils import raster_utils as raster_helpers
+from utils import fingerprint_utils as fingerprint_helpers
+from utils.utils import link_or_copy
+
 #----------------------------------------------------------
 # Set up a logger.
 #----------------------------------------------------------
@@ -33,75 +37,121 @@ logger.addHandler(f_handler)
 def merge_rasters(
     images_path,
     images,
-    images_merged_path
+    images_merged_path,
+    shared_static_images=None,
+    max_workers=None,
+    virtual=False,
 ):
     """
     Check for images that were split in GEE export and merge.
+
+    Events are merged in parallel across a pool of processes, each merge
+    streaming window by window with raster_utils.merge_images. If virtual
+    is True, split images are mosaicked as a VRT referencing them and
+    single images are hard linked, so no pixels are copied.
     
     Args:
         images_path (string): path to images
         images (list): list of images
         images_merged_path (string): path to directory to save merged images
+        shared_static_images (dict): static image names of products that were
+            not exported, mapped to the static image exported for the same AOI
+        max_workers (int): number of processes merging images
+        virtual (bool): write VRT mosaics and hard links instead of
+            merged and copied images
+        
+    Raises:
+        RuntimeError: if any merge failed, after all events are processed
         
     Returns:
         dictionary: dictionary with each element storing paths to ems vectors and images
     """
 
-    event_id_list = []
-
     os.makedirs(images_merged_path, exist_ok=True)
 
-    # Get a list of events and AOIs
-    for i in images:
-        event_id = i.split("_")
-        event_id = "_".join(event_id[:-2])
-        event_id_list.append(event_id)
-        
-    # Remove duplicate IDs to get unique event IDs 
-    event_id_list = list(set(event_id_list))
+    # Index the images by event and AOI. Images split in the GEE
+    # export share the name of the event before "_static_images".
+    images_index = index_helpers.ProductIndex(images)
 
-    # Iterate over each event and AOI to merge images
-    for f in event_id_list:
-        logger.info(f"processing event {f}")
+    # Merged images are GeoTIFFs, or VRTs of split images if virtual
+    merged_ext = ".vrt" if virtual else ".tif"
 
-        # Create an empty List to store file names matching event and AOI
-        event_aoi_tmp = []
+    # Share the CPUs between the COG compression threads of the workers
+    max_workers = max_workers or os.cpu_count()
+    num_threads = raster_helpers.pool_num_threads(max_workers)
 
-        # Create an empty list to store products matching event and AOI
-        event_aoi_product_tmp = []
-        
-        for i in images:
-            if i.startswith(f):
-                event_aoi_tmp.append(i)
-                event_aoi_product = i.split("_static")[0]
-                event_aoi_product_tmp.append(event_aoi_product)
-        
-        # Remove duplicate IDs to get unique event IDs and generate item
-        # for only the first product. Images should be the same for all
-        # products of the same event and AOI combination.
-        event_aoi_product_tmp = list(set(event_aoi_product_tmp))[0]
-        
-        list_to_merge = []
-
-        for i in event_aoi_tmp:
-            if i.startswith(event_aoi_product_tmp):
-                list_to_merge.append(os.path.join(images_path, i))
-
-        # For events with multiple images, merge images using 
-        # the merge command-line tool from GDAL. For events with 
-        # a single image, simply copy to the destination folder.
-        if len(list_to_merge) > 1:
-            logger.info(f"merging images for {i}")
-            merge_out_path = os.path.join(images_merged_path, f + "_static_images.tif")
-            merge_infiles = " ".join(list_to_merge)
-            merge_command = "gdal_merge.py -o " + merge_out_path + " " + merge_infiles + " -co COMPRESS=LZW -co BIGTIFF=YES -co PREDICTOR=2 -co TILED=YES"
-            os.system(merge_command)
+    # Iterate over each event and AOI to merge images
+    failed = []
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {}
+        for f, event_aoi_tmp in images_index.by_stem.items():
+            logger.info(f"processing event {f}")
+
+            list_to_merge = [os.path.join(images_path, i.name) for i in sorted(event_aoi_tmp)]
+            merge_out_stem = os.path.join(images_merged_path, f + "_static_images")
+
+            # Remove the output of a previous run in the other mode,
+            # so each event has a single static image
+            for ext in [".tif", ".vrt"]:
+                if os.path.lexists(merge_out_stem + ext):
+                    os.remove(merge_out_stem + ext)
+
+            # For events with multiple images, merge images window by
+            # window in a worker process, or write a VRT if virtual.
+            # For events with a single image, copy as a COG (or hard
+            # link if virtual) to the destination folder.
+            if len(list_to_merge) > 1 and virtual:
+                logger.info(f"building VRT for {f}")
+                raster_helpers.build_vrt(list_to_merge, merge_out_stem + merged_ext)
+            elif len(list_to_merge) > 1:
+                logger.info(f"merging images for {f}")
+                future = pool.submit(
+                    raster_helpers.merge_images,
+                    list_to_merge,
+                    merge_out_stem + merged_ext,
+                    num_threads=num_threads,
+                )
+                futures[future] = f
+            elif virtual:
+                logger.info(f"not merging images for {f}")
+                logger.info(f"linking image for {f}")
+                link_or_copy(list_to_merge[0], merge_out_stem + ".tif")
+            else:
+                logger.info(f"not merging images for {f}")
+                logger.info(f"copying image for {f}")
+                future = pool.submit(
+                    raster_helpers.copy_to_cog,
+                    list_to_merge[0],
+                    merge_out_stem + ".tif",
+                    num_threads=num_threads,
+                )
+                futures[future] = f
+
+        for future in as_completed(futures):
+            f = futures[future]
+            try:
+                future.result()
+                logger.info(f"merged images for {f}")
+            except Exception:
+                logger.exception(f"failed to merge images for {f}")
+                failed.append(f)
+
+    # Give products that share a static image with another
+    # product of the same AOI a link to the merged image.
+    for static_image, shared_static_image in (shared_static_images or {}).items():
+        for ext in [".tif", ".vrt"]:
+            shared_path = os.path.join(images_merged_path, shared_static_image + ext)
+            if os.path.exists(shared_path):
+                logger.info(f"linking {static_image} to {shared_static_image}")
+                link_or_copy(shared_path, os.path.join(images_merged_path, static_image + ext))
+                break
         else:
-            logger.info(f"not merging images for {f}")
-            logger.info(f"copying image for {f}")
-            merge_out_path = os.path.join(images_merged_path, f + "_static_images.tif")
-            file_to_copy = list_to_merge[0]
-            shutil.copy(file_to_copy, merge_out_path)
+            logger.warning(
+                f"static image {shared_static_image} shared by {static_image} is missing"
+            )
+
+    if failed:
+        raise RuntimeError(f"Failed to merge images for {sorted(failed)}")
 
 # Run the merge_rasters function
 if __name__ == "__main__":
@@ -109,6 +159,26 @@ if __name__ == "__main__":
     images = os.listdir(images_path)
     images_merged_path = os.path.join(os.getcwd(), "source-data", "static-images-merged")
 
-    merge_rasters(images_path, images, images_merged_path)
+    # Number of processes merging images
+    merge_workers = os.cpu_count()
+
+    # Write VRT mosaics referencing the images in static-images and hard
+    # links instead of merged and copied images. Later stages read the
+    # VRTs like GeoTIFFs, so static-images must be kept.
+    virtual_merge = True
+
+    # Mapping of products to the static images exported for their AOI
+    shared_static_images = fingerprint_helpers.read_shared_static_images(
+        os.path.join(os.getcwd(), "source-data", "Copernicus_EMS_metadata", "static_images_fingerprints.csv")
+    )
+
+    merge_rasters(
+        images_path,
+        images,
+        images_merged_path,
+        shared_static_images,
+        max_workers=merge_workers,
+        virtual=virtual_merge,
+    )
 
 logger.info(f"**********finished**********")
\ No newline at end of file
@@ -1,10 +1,30 @@
 # Import modules
 import os
-import pickle
 import shutil
 import logging
 import pandas as pd
 
+from utils import catalog_utils as catalog_helpers
+
+#----------------------------------------------------------
+# Set up a logger.
+#----------------------------------------------------------
+
+# Create a custom logger
+logger = logging.getLogger("04-get-satellite-date")
+logger.setLevel(logging.DEBUG)
+
+# Create handlers
+f_handler = logging.FileHandler("04-get-satellite-date.log")
+f_handler.setLevel(logging.DEBUG)
+
+# Create formatters and add it to handlers
+f_format = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+f_handler.setFormatter(f_format)
+
+# Add handlers to the logger
+logger.addHandler(f_handler)
+
 # ----------------------------------------------
 # Generate a CSV file with filename, event date, 
 # activation date, and satellite date columns 
@@ -13,7 +33,7 @@ import pandas as pd
 
 # Create a path to access merged raster files
 images_merged_path = os.path.join(os.getcwd(), "source-data", "static-images-merged")
-merged_images = os.listdir(images_merged_path)
+merged_images = sorted(os.listdir(images_merged_path))
 
 # Store the names of the files without -static-images in a list
 merged_file_list = []
@@ -60,31 +80,19 @@ code_dates_df = pd.DataFrame(code_dates)
 # Merge filename_code DataFrame with code_dates DataFrame using code as the key.
 merged_df = pd.merge(filename_code_df, code_dates_df, on='Code', how='left')
 
-# Create a path to EMS activations metadata
+# Read the satellite dates of the vector products from the catalog
 folder_metadata = os.path.join(os.getcwd(), "source-data", "Copernicus_EMS_metadata")
-
-# Get EMS activation metadata pickle files to get satellite dates
-metadata_files = os.listdir(folder_metadata)
-metadata_files_pickle = []
-for i in metadata_files:
-    if i.endswith(".pickle"):
-        metadata_files_pickle.append(i)
-
-satellite_date = []
-
-# Read the metadata pickle file of each event
-for i in metadata_files_pickle:
-    fpath = os.path.join(folder_metadata, i)
-    with open(fpath, "rb") as f:
-            metadata_floodmap = pickle.load(f)
-    
-    # Extract the satellite date of the event from the metadata
-    satellite_date_timestamp = metadata_floodmap["satellite date"]
-    satellite_date_ddmmyyyy = satellite_date_timestamp.strftime('%d/%m/%Y')
-    satellite_date.append(satellite_date_ddmmyyyy)
-
-# Add the satellite date list to the merged DataFrame as a column
-merged_df["Satellite Date"] = satellite_date
+catalog = catalog_helpers.read_catalog(
+    os.path.join(folder_metadata, "catalog.parquet"), columns=["name", "satellite_date"]
+)
+
+# Add the satellite date of each merged static image, joined on its event id.
+# An event id can be shared by several vector products (e.g. versions), so
+# keep the satellite date of the last product by name.
+catalog = catalog.sort_values("name")
+satellite_date = catalog["satellite_date"].dt.strftime('%d/%m/%Y')
+satellite_date = satellite_date[~satellite_date.index.duplicated(keep="last")]
+merged_df["Satellite Date"] = merged_df["File Name"].map(satellite_date)
 
 # Drop the Code column from the DataFrame
 merged_df_dropcode = merged_df.drop("Code", axis=1)
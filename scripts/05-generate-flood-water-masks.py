@@ -4,7 +4,16 @@ import rasterio
 import logging
 import numpy as np
 import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from rasterio import features
+from rasterio import windows
+from shapely.geometry import box
+
+from utils import product_index as index_helpers
+from utils import floodmap_store
+from utils import raster_utils as raster_helpers
+from utils.utils import memory_aware_workers
 
 # Adapted from https://github.com/spaceml-org/ml4floods/blob/main/ml4floods/data/copernicusEMS/activations.py
 
@@ -49,121 +58,343 @@ CODES_FLOODMAP = {
 }
 
 
-def compute_water(
-    floodmap: gpd.GeoDataFrame,
-    permanent_water_path: str = None,
-    keep_streams: bool = True,
-    out_path: str = None,
-) -> np.ndarray:
+def floodmap_shapes(floodmap: gpd.GeoDataFrame, target_crs, keep_streams: bool = True):
     """
-    Rasterise flood map and add land cover layer from ESA and permanent water layer from JRC
-    Adapted from https://github.com/spaceml-org/ml4floods/blob/main/ml4floods/data/copernicusEMS/activations.py
+    Get the (geometry, code) pairs to rasterise from a flood map.
+
+    The flood map is not copied or modified: only its geometry column is
+    reprojected if needed, and rows are selected with boolean arrays.
 
     Args:
         floodmap: geopandas dataframe with the annotated polygons
-        permanent_water_path: Static images path
+        target_crs: CRS of the static image
         keep_streams: A boolean flag to indicate whether to include streams in the water mask
-        out_path: path to save ground truth image output
     Returns:
-        water_mask : np.int16 raster same shape as static image tiff file 
-        {0: invalid, 1: land, 2: flood, 3: hydrology and permanentwaterjrc}
+        shapes_rasterise : list of (geometry, code) pairs of the flood map classes
+        shapes_aoi : list of (geometry, 1) pairs of the area_of_interest polygons,
+        or None if the flood map has no area_of_interest polygons
     """
 
-    # Retrieve the shape, transform, and the CRS
-    # of the permanent water raster dataset.
-    with rasterio.open(permanent_water_path) as src:
-        out_shape = src.shape
-        transform = src.transform
-        target_crs = src.crs
-
     # Transform the CRS of floodmap to the CRS of the permanent 
     # water raster if they are not already the same.
+    geometry = floodmap.geometry
     if str(floodmap.crs).lower() != target_crs:
-        floodmap.to_crs(crs=target_crs, inplace=True)
-
-    # Subset area_of_interest from the attribute table. 
-    # Values outside of AOI should be marked as invalid.
-    floodmap_aoi = floodmap[
-        floodmap["w_class"] == "area_of_interest"
-    ]  
-
-    # Subset everything except area_of_interest from the
-    # attribute table for rasterisation.
-    floodmap_rasterise = floodmap.copy()
-    if floodmap_aoi.shape[0] > 0:
-        floodmap_rasterise = floodmap_rasterise[
-            floodmap_rasterise["w_class"] != "area_of_interest"
-        ]
+        geometry = geometry.to_crs(crs=target_crs)
+    geometry = geometry.values
+
+    # Area_of_interest rows mark valid values. Everything else
+    # is rasterised.
+    w_class = floodmap["w_class"].to_numpy()
+    is_aoi = w_class == "area_of_interest"
+    is_rasterised = ~is_aoi
 
     # If keep_streams flag is set to "False", subset everything
     # except rows that have source = hydro_1 (river, stream, coastline
     # river bank, rapids, waterfall).
     if not keep_streams:
-        floodmap_rasterise = floodmap_rasterise[
-            floodmap_rasterise["source"] != "hydro_l"
-        ]
+        is_rasterised &= floodmap["source"].to_numpy() != "hydro_l"
 
     # Get the geometry of each object and map each object's w_class 
     # to its corresponding numerical code from CODES_FLOODMAP.
-    shapes_rasterise = (
+    shapes_rasterise = [
         (g, CODES_FLOODMAP[w])
-        for g, w in floodmap_rasterise[["geometry", "w_class"]].itertuples(
-            index=False, name=None
-        )
+        for g, w in zip(geometry[is_rasterised], w_class[is_rasterised])
         if g and not g.is_empty
-    )
+    ]
 
-    # Rasterise vector floodmaps with the codes from CODES_FLOODMAP.
-    # Set all empty grids to 1 (Land).
-    water_mask = features.rasterize(
-        shapes=shapes_rasterise,
-        fill=1,
-        out_shape=out_shape,
-        dtype=np.uint8,
-        transform=transform,
-        all_touched=keep_streams,
-    )
-
-    # Load valid mask using the area_of_interest polygons.
     # Valid pixels are those within the area_of_interest polygons.
-    if floodmap_aoi.shape[0] > 0:
-        shapes_rasterise = (
-            (g, 1)
-            for g, w in floodmap_aoi[["geometry", "w_class"]].itertuples(
-                index=False, name=None
-            )
+    shapes_aoi = None
+    if is_aoi.any():
+        shapes_aoi = [(g, 1) for g in geometry[is_aoi] if g and not g.is_empty]
+
+    return shapes_rasterise, shapes_aoi
+
+
+class ShapeIndex:
+    """
+    Spatial index of (geometry, value) pairs to rasterise, used to send only
+    the geometries intersecting a window to the rasteriser. Geometries are
+    clipped to the window and optionally simplified first, so the vertex
+    count burned per window stays small for dense hydrography layers.
+
+    Args:
+        shapes: (geometry, value) pairs from floodmap_shapes
+    """
+
+    def __init__(self, shapes):
+        self.geometries = gpd.GeoSeries([g for g, _ in shapes])
+        self.values = np.array([v for _, v in shapes])
+
+    def window_shapes(self, bounds, margin, simplify_tolerance=None):
+        """
+        Get the shapes intersecting a window, in their original order so
+        later shapes still overwrite earlier ones.
+
+        Args:
+            bounds: (left, bottom, right, top) of the window
+            margin: distance added around the window before clipping. One
+                pixel keeps the clipped edges off the window's pixels, so
+                clipping does not change the rasterised pixels.
+            simplify_tolerance: distance to simplify geometries by, or None
+        Returns:
+            list of (geometry, value) pairs
+        """
+        left, bottom, right, top = bounds
+        clip = box(left - margin, bottom - margin, right + margin, top + margin)
+
+        index = np.sort(self.geometries.sindex.query(clip, predicate="intersects"))
+        geometries = self.geometries.iloc[index]
+
+        # Clip valid geometries to the window. Invalid geometries are kept
+        # whole because overlay operations may fail on them.
+        valid = geometries.is_valid
+        geometries = geometries.copy()
+        geometries[valid] = geometries[valid].intersection(clip)
+
+        if simplify_tolerance:
+            geometries = geometries.simplify(simplify_tolerance, preserve_topology=True)
+
+        return [
+            (g, v)
+            for g, v in zip(geometries.values, self.values[index])
             if g and not g.is_empty
+        ]
+
+
+class WaterMaskBuffers:
+    """
+    Buffers reused by water_mask_window across windows, sized for the
+    largest window. Views of the first height * width elements are
+    contiguous arrays of any window shape.
+    """
+
+    def __init__(self, size):
+        self.water_mask = np.empty(size, dtype=np.uint8)
+        self.valid_mask = np.empty(size, dtype=np.uint8)
+        self.flag = np.empty(size, dtype=bool)
+
+    def views(self, shape):
+        n = shape[0] * shape[1]
+        if n > self.water_mask.size:
+            self.__init__(n)
+        return (
+            self.water_mask[:n].reshape(shape),
+            self.valid_mask[:n].reshape(shape),
+            self.flag[:n].reshape(shape),
         )
-        valid_mask = features.rasterize(
+
+
+def water_mask_window(
+    shapes_rasterise,
+    shapes_aoi,
+    permanent_water: np.ndarray,
+    transform,
+    keep_streams: bool = True,
+    buffers: WaterMaskBuffers = None,
+) -> np.ndarray:
+    """
+    Rasterise flood map shapes on a grid and add the permanent water layer.
+
+    Shapes are burned into preallocated buffers and the AOI and permanent
+    water masks are applied in place, so no full-size temporaries are made.
+
+    Args:
+        shapes_rasterise: (geometry, code) pairs from floodmap_shapes
+        shapes_aoi: area_of_interest (geometry, 1) pairs from floodmap_shapes, or None
+        permanent_water: ESA WorldCover band of the static image on the grid
+        transform: affine transform of the grid
+        keep_streams: A boolean flag to indicate whether to include streams in the water mask
+        buffers: buffers to burn into, allocated for this grid if not given
+    Returns:
+        water_mask : np.uint8 raster with the shape of permanent_water.
+        It is a view of the buffers, overwritten by the next call.
+    """
+    out_shape = permanent_water.shape
+    if buffers is None:
+        buffers = WaterMaskBuffers(permanent_water.size)
+    water_mask, valid_mask, flag = buffers.views(out_shape)
+
+    # Rasterise vector floodmaps with the codes from CODES_FLOODMAP.
+    # Set all empty grids to 1 (Land).
+    water_mask.fill(1)
+    if shapes_rasterise:
+        features.rasterize(
             shapes=shapes_rasterise,
-            fill=0,
-            out_shape=out_shape,
-            dtype=np.uint8,
+            out=water_mask,
             transform=transform,
-            all_touched=True,
+            all_touched=keep_streams,
         )
+
+    # Load valid mask using the area_of_interest polygons. The AOI is
+    # always burned with all_touched, so it cannot share the class burn.
+    if shapes_aoi is not None:
+        valid_mask.fill(0)
+        if shapes_aoi:
+            features.rasterize(
+                shapes=shapes_aoi,
+                out=valid_mask,
+                transform=transform,
+                all_touched=True,
+            )
         
         # Every pixel outside the area-of-interest is given a value of 0. 
-        water_mask[valid_mask == 0] = 0
-
-    # Get permanent water layer from ESA World Cover
-    with rasterio.open(permanent_water_path) as src:
-        permanent_water = src.read(2)  # ESA WorldCover
-        out_meta = src.meta
+        np.equal(valid_mask, 0, out=flag)
+        np.putmask(water_mask, flag, 0)
 
     # Assign permanent water areas a value of 3. We are only
     # interested in the permanent water, which has a value of 80,  
     # that is within the valid water masks.
-    water_mask[(water_mask != 0) & (permanent_water == 80)] = 3
+    np.equal(permanent_water, 80, out=flag)
+    np.logical_and(flag, water_mask, out=flag)
+    np.putmask(water_mask, flag, 3)
+
+    return water_mask
+
+
+def compute_water(
+    floodmap: gpd.GeoDataFrame,
+    permanent_water_path: str = None,
+    keep_streams: bool = True,
+    out_path: str = None,
+    windowed: bool = True,
+    window_size: int = 1024,
+    simplify_tolerance: float = None,
+    num_threads="ALL_CPUS",
+) -> np.ndarray:
+    """
+    Rasterise flood map and add land cover layer from ESA and permanent water layer from JRC
+    Adapted from https://github.com/spaceml-org/ml4floods/blob/main/ml4floods/data/copernicusEMS/activations.py
+
+    If windowed is True, the flood map is rasterised, masked and written one
+    window of the static image's block grid at a time, so peak memory does
+    not depend on the size of the AOI. The output is identical to rasterising
+    the whole image at once. In windowed mode only the geometries
+    intersecting each window are clipped to it and rasterised.
+
+    Args:
+        floodmap: geopandas dataframe with the annotated polygons
+        permanent_water_path: Static images path
+        keep_streams: A boolean flag to indicate whether to include streams in the water mask
+        out_path: path to save ground truth image output
+        windowed: A boolean flag to process the image window by window
+        window_size: approximate size in pixels of the windows processed at once
+        simplify_tolerance: tolerance in pixels to simplify geometries by
+            before rasterising in windowed mode, e.g. 0.25. Simplifying
+            may move class boundaries by a fraction of a pixel.
+        num_threads: number of COG compression threads, or "ALL_CPUS"
+    Returns:
+        water_mask : np.int16 raster same shape as static image tiff file 
+        {0: invalid, 1: land, 2: flood, 3: hydrology and permanentwaterjrc}
+    """
 
-    # Set the number of band and data type for the 
-    # new metadata of the ground truth image output.
-    out_meta["count"] = 1
-    out_meta["dtype"] = np.uint8
+    with rasterio.open(permanent_water_path) as src:
+        shapes_rasterise, shapes_aoi = floodmap_shapes(floodmap, src.crs, keep_streams)
+
+        # Set the number of band and data type for the 
+        # new metadata of the ground truth image output.
+        out_meta = src.meta
+        out_meta["count"] = 1
+        out_meta["dtype"] = np.uint8
+
+        # Save the ground truth image as a COG. Overviews of the
+        # classes use the most common class of each block.
+        with raster_helpers.cog_writer(
+            out_path, out_meta, overview_resampling="MODE", num_threads=num_threads
+        ) as dst:
+            if not windowed:
+                # Get permanent water layer from ESA World Cover
+                water_mask = water_mask_window(
+                    shapes_rasterise,
+                    shapes_aoi,
+                    src.read(2),
+                    src.transform,
+                    keep_streams,
+                )
+                dst.write(water_mask, 1)
+                return
+
+            # Index the shapes to cull and clip them to each window
+            rasterise_index = ShapeIndex(shapes_rasterise)
+            aoi_index = ShapeIndex(shapes_aoi) if shapes_aoi is not None else None
+            pixel_size = max(abs(src.transform.a), abs(src.transform.e))
+            tolerance = simplify_tolerance * pixel_size if simplify_tolerance else None
+
+            # Reuse the same buffers for every window
+            block_list = list(raster_helpers.block_windows(src, window_size))
+            size = max(w.height * w.width for w in block_list)
+            buffers = WaterMaskBuffers(size)
+            permanent_water = np.empty(size, dtype=src.dtypes[1])
+
+            for window in block_list:
+                shape = (window.height, window.width)
+                permanent_water_window = src.read(
+                    2,
+                    window=window,
+                    out=permanent_water[: shape[0] * shape[1]].reshape(shape),
+                )
+                window_bounds = windows.bounds(window, src.transform)
+                water_mask = water_mask_window(
+                    rasterise_index.window_shapes(window_bounds, pixel_size, tolerance),
+                    aoi_index.window_shapes(window_bounds, pixel_size, tolerance)
+                    if aoi_index is not None
+                    else None,
+                    permanent_water_window,
+                    windows.transform(window, src.transform),
+                    keep_streams,
+                    buffers,
+                )
+                dst.write(water_mask, 1, window=window)
+
+
+def process_event(
+    name,
+    static_image_names,
+    folder_store,
+    static_images_path,
+    ground_truth_path,
+    gdal_cachemax_mb=256,
+    **compute_water_kwargs,
+):
+    """
+    Generate the ground truth images of one vector product, for every
+    static image matching it. The floodmap is read once for all of them.
+
+    Args:
+        name: name of the vector product in the floodmap store
+        static_image_names: names of the matching static images
+        folder_store: path to the GeoParquet store of floodmaps
+        static_images_path: path to the static images
+        ground_truth_path: path to save ground truth images
+        gdal_cachemax_mb: size of the GDAL block cache of the worker in MB
+        compute_water_kwargs: keyword arguments of compute_water
+    Returns:
+        dict with the product name, its status ("processed" or "failed"),
+        the paths of the ground truth images written and the traceback of
+        a failure
+    """
+    result = {"name": name, "status": "processed", "outputs": [], "error": None}
+    try:
+        with rasterio.Env(GDAL_CACHEMAX=gdal_cachemax_mb):
+            # Only the partition and columns that are rasterised are loaded.
+            floodmap = floodmap_store.read_floodmap(folder_store, name=name)
+
+            # Configure output name to be saved and run compute_water function.
+            # Outputs follow the naming of the vector products.
+            for static_image_name in static_image_names:
+                permanent_water_path = os.path.join(static_images_path, static_image_name)
+                out_fname = os.path.splitext(
+                    index_helpers.fixed_static_image_name(static_image_name)
+                )[0]
+                out_path = os.path.join(ground_truth_path, out_fname + "_ground_truth.tif")
+                compute_water(
+                    floodmap, permanent_water_path, True, out_path, **compute_water_kwargs
+                )
+                result["outputs"].append(out_path)
+    except Exception:
+        result["status"] = "failed"
+        result["error"] = traceback.format_exc()
+    return result
 
-    # Save the ground truth image output with the new metadata
-    with rasterio.open(out_path, "w", **out_meta) as dst:
-        dst.write(water_mask, 1)
 
 if __name__ == "__main__":
     
@@ -190,9 +421,9 @@ if __name__ == "__main__":
     # layer and to save ground truth images
     # ---------------------------------------
 
-    # Path to EMSR activations
-    folder_metadata = os.path.join(
-        os.getcwd(), "source-data", "Copernicus_EMS_metadata"
+    # Path to the GeoParquet store of EMSR floodmaps
+    folder_store = os.path.join(
+        os.getcwd(), "source-data", "Copernicus_EMS_floodmaps"
     )
 
     # Path to static images
@@ -200,106 +431,94 @@ if __name__ == "__main__":
         os.getcwd(), "source-data", "static-images-merged"
     )
 
-    # Get static images of permanent water layer and land cover
-    static_images = os.listdir(static_images_path)
+    # Index static images of permanent water layer and land cover
+    # by EMSR code, AOI, product type and MONIT number
+    static_images_index = index_helpers.ProductIndex.from_dir(static_images_path)
 
     # Path to save ground truth images
     ground_truth_path = os.path.join(os.getcwd(), "source-data", "ground-truth")
     os.makedirs(ground_truth_path, exist_ok=True)
 
-    # Get all processed EMSR vector floodmaps
-    emsr_floodmaps = os.listdir(folder_metadata)
-    emsr_floodmaps_geojson = []
+    # Rasterise, mask and write ground truth images one window at a time,
+    # so memory use does not depend on the size of the AOI
+    windowed = True
+    window_size = 1024
 
-    for i in emsr_floodmaps:
-        if i.endswith(".geojson"):
-            emsr_floodmaps_geojson.append(i)
-    
+    # Tolerance in pixels to simplify flood map geometries by before
+    # rasterising (None to rasterise the geometries as they are)
+    simplify_tolerance = None
+
+    # Size of the GDAL block cache of each worker and estimated peak
+    # memory of a worker in MB, used to choose the number of workers
+    gdal_cachemax_mb = 256
+    worker_memory_mb = 2048
+
+    # Get all processed EMSR vector floodmaps
+    emsr_floodmaps = floodmap_store.list_products(folder_store)
     
-    # -----------------------------------------------------------
-    # Fix the file names in static-images-merged folder that have
-    # non-matching names with their corresponding floodmap file
-    # names in Copernicus_EMS_metadata folder. Because we are 
-    # combining files from the same EMSR activation, the code 
-    # requires the file names to be consistent.
-    # -----------------------------------------------------------
     
-    # Fix the naming of mapping products
-    static_images_names_fixed_1 = []
-
-    for filename in static_images:
-        parts = filename.split('_')  
-        if parts[1].startswith("AOI"):
-            static_images_names_fixed_1.append(filename)   # Keep the original name if no change needed
-        else:
-            if parts[2].startswith("DEL") and parts[3].startswith("v"):
-                parts[2] = parts[2].replace("DEL","01DELINEATION_MAP")  # Replace DEL with 01DELINEATION_MAP it is not a MONIT
-                static_images_names_fixed_1.append('_'.join(parts))
-            elif parts[2] == "DEL" and parts[3].startswith("MONIT"):
-                parts[2] = parts[2].replace("DEL","01DELINEATION")  # Replace DEL with just 01DELINEATION it is a MONIT
-                static_images_names_fixed_1.append('_'.join(parts))
-            elif parts[2].startswith("GRA") and parts[3].startswith("v"):
-                parts[2] = parts[2].replace("GRA","02GRADING_MAP")  # Repalce GRA with 02GRADING_MAP
-                static_images_names_fixed_1.append('_'.join(parts))
-            elif parts[2].startswith("GRA") and parts[3].startswith("MONIT"):
-                parts[2] = parts[2].replace("GRA","02GRADING")  # Repalce GRA with 02GRADING_MAP
-                static_images_names_fixed_1.append('_'.join(parts))
-            else:
-                static_images_names_fixed_1.append(filename)  # Keep the original name if no change needed
-
-    # Fix the naming of AOI
-    static_images_names_fixed_2 = []
-
-    for filename in static_images_names_fixed_1:
-            parts = filename.split('_')  
-            if parts[1].startswith("03MURAMBINDASW"):
-                parts[1] = parts[1][:-2] + "SOUTHWEST"  # Replace SW with SOUTHWEST
-                static_images_names_fixed_2.append('_'.join(parts))
-            elif parts[1].startswith("04MURAMBINDASE"):
-                parts[1] = parts[1][:-2] + "SOUTHEAST"  # Replace SE with SOUTHEAST
-                static_images_names_fixed_2.append('_'.join(parts))
-            elif parts[1].startswith("06RUSITUVALLEYSW"):
-                parts[1] = parts[1][:-2] + "SOUTHWEST"  # Replace SW with SOUTHWEST
-                static_images_names_fixed_2.append('_'.join(parts))
-            elif parts[1].startswith("07RUSITUVALLEYSE"):
-                parts[1] = parts[1][:-2] + "SOUTHEAST"  # Replace SE with SOUTHEAST
-                static_images_names_fixed_2.append('_'.join(parts))
-            else:
-                static_images_names_fixed_2.append(filename)  # Keep the original name if no change needed
-     
-    # Apply the changes to the local static_images_merged folder
-    for old_name, new_name in zip(static_images, static_images_names_fixed_2):
-        old_path = os.path.join(static_images_path, old_name)
-        new_path = os.path.join(static_images_path, new_name)
-        os.rename(old_path, new_path)
-        
-        
     # -----------------------------------------
     # Generate ground truth data for each event 
     # using the compute_water function
     # -----------------------------------------
-    
-    for i in emsr_floodmaps_geojson:
-        logger.info(f"generating ground truth for event {i}")
-        try:
-            # Get EMSR code and AOI for each event
-            emsrcode_AOI_product_monit = i.split("_")[0:4]
-            emsrcode_AOI_product_monit = "_".join(emsrcode_AOI_product_monit)
-
-            # Configure output name to be saved and run compute_water function
-            for z in static_images_names_fixed_2:
-                if z.startswith(emsrcode_AOI_product_monit):
-                    permanent_water_path = os.path.join(static_images_path, z)
-                    floodmap = gpd.read_file(os.path.join(folder_metadata, i))
-                    out_fname = z.split(".tif")[0]
-                    out_fname = out_fname + "_ground_truth.tif"
-                    out_path = os.path.join(ground_truth_path, out_fname)
-                    compute_water(
-                        floodmap, str(permanent_water_path), True, str(out_path)
-                    )
-                    logger.info(f"ground truth for event {i} saved to {out_path}")
-        except:
-            logger.warning(f"failed to generate ground truth for event {i}")
+
+    # Get static images matching the EMSR code, AOI, product
+    # and MONIT number of each event. Static images are named after
+    # the EMS event id, which abbreviates the product type and some
+    # AOIs, so they are matched on the parsed names.
+    events = {}
+    for i in emsr_floodmaps:
+        floodmap_product = index_helpers.parse_product_name(i)
+        static_images_event = static_images_index.matching(floodmap_product)
+        if len(static_images_event) == 0:
+            logger.info(f"no static images for event {i}")
             continue
+        events[i] = [z.name for z in static_images_event]
+
+    # Process events across a pool of processes, as many as fit in memory
+    workers = memory_aware_workers(worker_memory_mb)
+    logger.info(f"generating ground truth for {len(events)} events with {workers} workers")
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(
+                process_event,
+                i,
+                static_image_names,
+                folder_store,
+                static_images_path,
+                ground_truth_path,
+                gdal_cachemax_mb=gdal_cachemax_mb,
+                windowed=windowed,
+                window_size=window_size,
+                simplify_tolerance=simplify_tolerance,
+                num_threads=raster_helpers.pool_num_threads(workers),
+            ): i
+            for i, static_image_names in events.items()
+        }
+        for future in as_completed(futures):
+            # Report a crashed worker as a failed event
+            try:
+                result = future.result()
+            except Exception:
+                result = {
+                    "name": futures[future],
+                    "status": "failed",
+                    "outputs": [],
+                    "error": traceback.format_exc(),
+                }
+            results.append(result)
+
+            if result["status"] == "processed":
+                for out_path in result["outputs"]:
+                    logger.info(f"ground truth for event {result['name']} saved to {out_path}")
+            else:
+                logger.error(
+                    f"failed to generate ground truth for event {result['name']}\n{result['error']}"
+                )
+
+    failed = [r["name"] for r in results if r["status"] == "failed"]
+    logger.info(f"{len(results) - len(failed)} events processed, {len(failed)} failed")
 
-logger.info(f"**********finished**********")
\ No newline at end of file
+    logger.info(f"**********finished**********")
@@ -5,245 +5,447 @@ from rasterio.windows import Window
 import logging
 import numpy as np
 import os
+import json
+import fcntl
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from rasterio import features
 
+from utils import product_index as index_helpers
+from utils import raster_utils as raster_helpers
+from utils.utils import atomic_write, file_digest, memory_aware_workers
 
-def generate_ground_truth(ground_truth_dir, ground_truth_merge_dir):
+
+def common_windows(paths):
     """
-    Generate ground truth images of EMS activation flood events and permanent water.
+    Get the window of each flood-water mask of an AOI that covers the bounding
+    box shared by the masks, from the raster headers only.
 
-    Combine all flood maps for an EMS activation event (e.g. generated on different dates).
+    The shared bounding box is the intersection of the largest and the
+    smallest bounding boxes of the masks. The windows have the same shape,
+    so the masks can be merged pixel by pixel.
 
     Args:
-        ground_truth_dir: directory of ground truth flood water masks - there can be several
-        EMSR activations per event as the event unfolds over time.
+        paths: paths to the flood-water masks of the AOI
+    Returns:
+        tuple of the shared bounding box (left, bottom, right, top) and the
+        list of integer windows, one per mask
+    """
+    # Get the bounds and transform of each file of the AOI
+    headers = []
+    for path in paths:
+        with rasterio.open(path) as src:
+            headers.append((src.bounds, src.transform))
+
+    # Get the smallest and the largest bounding boxes
+    def area(header):
+        bounds = header[0]
+        return (bounds.right - bounds.left) * (bounds.top - bounds.bottom)
+
+    smallest = min(headers, key=area)
+    largest = max(headers, key=area)
+
+    # Intersect the largest bounding box with the smallest bounding box
+    left = max(largest[0].left, smallest[0].left)
+    bottom = max(largest[0].bottom, smallest[0].bottom)
+    right = min(largest[0].right, smallest[0].right)
+    top = min(largest[0].top, smallest[0].top)
+    if not (left < right and bottom < top):
+        raise ValueError(f"bounding boxes of {paths} do not intersect")
+
+    # Shape of the intersection on the grid of the largest bounding box
+    reference = rasterio.windows.from_bounds(left, bottom, right, top, transform=largest[1])
+    height = int(round(reference.height))
+    width = int(round(reference.width))
+
+    # Window of the intersection in each file
+    windows = []
+    for _, transform in headers:
+        window = rasterio.windows.from_bounds(left, bottom, right, top, transform=transform)
+        windows.append(
+            Window(int(round(window.col_off)), int(round(window.row_off)), width, height)
+        )
+
+    return (left, bottom, right, top), windows
+
+
+def write_cropped(path, window, out_path):
+    """
+    Save the part of a flood-water mask in a window to a new raster file.
+    """
+    with rasterio.open(path) as src:
+        cropped_data = src.read(window=window)
+        cropped_meta = src.meta.copy()
+        cropped_meta.update(
+            {
+                "height": window.height,
+                "width": window.width,
+                "transform": rasterio.windows.transform(window, src.transform),
+            }
+        )
+    with atomic_write(out_path) as tmp_path:
+        with rasterio.open(tmp_path, "w", **cropped_meta) as dst:
+            dst.write(cropped_data)
+
+
+def reduce_max_extent(paths, windows, out_path, window_size=1024, num_threads="ALL_CPUS"):
+    """
+    Aggregate land, flood, and water pixels from the flood-water masks of
+    an AOI to determine the maximum extent of flood that occured.
 
-        ground_truth_merge_dir: directory to store merged ground truth flood water masks
+    Each mask is read directly with its window from common_windows, one
+    output window at a time. The land, flood and water pixels of each mask
+    are ORed into three preallocated boolean planes, which are combined in
+    place with water taking precedence over flood and flood over land, so
+    peak memory depends on the window size only, not on the number of masks.
+
+    Args:
+        paths: paths to the flood-water masks of the AOI
+        windows: window of each mask covering the shared bounding box
+        out_path: path to save the merged ground truth
+        window_size: size in pixels of the output windows processed at once
+        num_threads: number of COG compression threads, or "ALL_CPUS"
     """
-    # Set up output directories
-    os.makedirs(ground_truth_bb_fixed_path, exist_ok=True)
-    os.makedirs(ground_truth_merge_dir, exist_ok=True)
+    height, width = windows[0].height, windows[0].width
+    sources = [rasterio.open(p) for p in paths]
+    try:
+        first = sources[0]
+
+        # Buffers reused for every window. Views of the first height * width
+        # elements are contiguous arrays of any window shape.
+        size = min(window_size, height) * min(window_size, width)
+        land_plane = np.empty(size, dtype=bool)
+        flood_plane = np.empty(size, dtype=bool)
+        water_plane = np.empty(size, dtype=bool)
+        raster_buffer = np.empty(size, dtype=first.dtypes[0])
+        merged_buffer = np.empty(size, dtype=np.uint8)
+
+        meta = first.meta
+        meta.update(
+            {
+                "dtype": np.uint8,
+                "height": height,
+                "width": width,
+                "transform": rasterio.windows.transform(windows[0], first.transform),
+            }
+        )
+
+        with raster_helpers.cog_writer(
+            out_path, meta, overview_resampling="MODE", num_threads=num_threads
+        ) as dst:
+            for row_off in range(0, height, window_size):
+                for col_off in range(0, width, window_size):
+                    window = Window(
+                        col_off,
+                        row_off,
+                        min(window_size, width - col_off),
+                        min(window_size, height - row_off),
+                    )
+                    shape = (window.height, window.width)
+                    n = window.height * window.width
+                    land = land_plane[:n].reshape(shape)
+                    flood = flood_plane[:n].reshape(shape)
+                    water = water_plane[:n].reshape(shape)
+                    land.fill(False)
+                    flood.fill(False)
+                    water.fill(False)
+
+                    # Mark the presence of land, flood and water pixels
+                    # across all flood-water mask files
+                    for src, src_window in zip(sources, windows):
+                        raster = src.read(
+                            1,
+                            window=Window(
+                                src_window.col_off + col_off,
+                                src_window.row_off + row_off,
+                                window.width,
+                                window.height,
+                            ),
+                            out=raster_buffer[:n].reshape(shape),
+                        )
+                        land |= raster == 1
+                        flood |= raster == 2
+                        water |= raster > 2
+
+                    # Flood values should occupy the pixel if there are both
+                    # flood and land values on the same pixel, and water values
+                    # if there are water and flood or land values.
+                    merged = merged_buffer[:n].reshape(shape)
+                    merged.fill(0)
+                    np.putmask(merged, land, 1)
+                    np.putmask(merged, flood, 2)
+                    np.putmask(merged, water, 3)
+
+                    dst.write(merged, 1, window=window)
+    finally:
+        for src in sources:
+            src.close()
+
+
+def provenance_path(out_path):
+    """
+    Get the path of the provenance file of a merged ground truth.
+    """
+    return os.path.splitext(out_path)[0] + ".json"
 
-    # Get a list of EMSR events
-    ground_truth_files = os.listdir(ground_truth_dir)
 
-    emsr_events = []
+def input_provenance(paths, previous=None):
+    """
+    Describe the flood-water masks merged into a ground truth by their name,
+    size, modification time and content hash.
 
-    for i in ground_truth_files:
-        emsr_aoi_id = i.split("_")[0:2]
-        emsr_aoi_id = "_".join(emsr_aoi_id)
-        emsr_events.append(emsr_aoi_id)
+    The hash of a mask is taken from previous if its size and modification
+    time did not change, so unchanged masks are not read again.
 
-    # Get unique EMSR events by removing duplicates
-    emsr_events = list(set(emsr_events))
-    emsr_events = sorted(emsr_events)
+    Args:
+        paths: paths to the flood-water masks
+        previous: inputs of the provenance file of the ground truth
+    Returns:
+        dict of mask name to a dict with its size, mtime and sha1
+    """
+    previous = previous or {}
+    inputs = {}
+    for path in paths:
+        name = os.path.basename(path)
+        stat = os.stat(path)
+        record = {"size": stat.st_size, "mtime": stat.st_mtime}
+        known = previous.get(name)
+        if known and known["size"] == record["size"] and known["mtime"] == record["mtime"]:
+            record["sha1"] = known["sha1"]
+        else:
+            record["sha1"] = file_digest(path)
+        inputs[name] = record
+    return inputs
+
+
+def merge_aoi(
+    event_aoi,
+    paths,
+    out_path,
+    ground_truth_bb_fixed_path=None,
+    window_size=1024,
+    gdal_cachemax_mb=256,
+    num_threads="ALL_CPUS",
+):
+    """
+    Merge the flood-water masks of an AOI into its ground truth, or update
+    its ground truth with masks added since it was merged.
 
-    # Create a list of already processed ground truth files
-    processed = os.listdir(ground_truth_merge_dir)
-    processed_event = []
-    
-    for i in processed:
-        tmp_event_id = i.split("_")[0:2]
-        tmp_event_id = "_".join(tmp_event_id)
-        processed_event.append(tmp_event_id)
-    
-    # Fix bounding box and merge pixel values for each file
-    for i in emsr_events:
-        if i not in processed_event:
-            print(i)
-            try:
-                logger.info(f"starting to generate ground truth for EMSR event {i}")
-               
-                # --------------------------------------------------------
-                # Fix bounding boxes with different shapes for each AOI to 
-                # be the same shape. This ensures successful aggregation 
-                # of raster pixels during the merging process.
-                # -------------------------------------------------------- 
-                
-                # Get a list of ground truth files that match the event being processed
-                aoi_tmp = []
-                for z in ground_truth_files:
-                    if z.startswith(i):
-                        aoi_tmp.append(z)
-
-                # Get the window for intersecting rasters. This window is the largest
-                # bounding box that intersects all raster files within in an AOI.
-                bounding_boxes = []
-
-                # Get the bounds of each file of the AOI that is being processed
-                for j in aoi_tmp:
-                    path = os.path.join(ground_truth_dir, j)
-                    with rasterio.open(path) as src:
-                        bound = src.bounds
-                        bounding_boxes.append(bound)
-
-                    # Get the index of the smallest and the largest bounding boxes
-                    index_of_smallest = min(
-                        range(len(bounding_boxes)),
-                        key=lambda i: (bounding_boxes[i][2] - bounding_boxes[i][0])
-                        * (bounding_boxes[i][3] - bounding_boxes[i][1]),
-                    )
-                    index_of_largest = max(
-                        range(len(bounding_boxes)),
-                        key=lambda i: (bounding_boxes[i][2] - bounding_boxes[i][0])
-                        * (bounding_boxes[i][3] - bounding_boxes[i][1]),
-                    )
+    The masks merged into a ground truth, with their content hashes, and the
+    shared bounding box of the masks are recorded in a provenance file next
+    to it. A ground truth is:
 
-                    # Create paths to the AOIs that have the smallest and the largest bounding boxes
-                    path_smallest_box = os.path.join(
-                        ground_truth_dir, aoi_tmp[index_of_smallest]
-                    )
-                    path_largest_box = os.path.join(
-                        ground_truth_dir, aoi_tmp[index_of_largest]
-                    )
+    - skipped if its masks did not change;
+    - updated by merging the new masks into it, without reading the masks
+      already merged, if masks were only added and the shared bounding box
+      did not change;
+    - merged again from all its masks if a mask changed or was removed, the
+      shared bounding box changed, or it has no provenance file.
 
-                # Intersect the largest bounding box with the smallest bounding box
-                for k in aoi_tmp:
-                    path = os.path.join(ground_truth_dir, k)
-
-                    # Open the raster to be fixed
-                    with rasterio.open(path_largest_box) as src:
-                        
-                        # Open the reference raster for intersection
-                        with rasterio.open(path_smallest_box) as ref:
-                            
-                            # Calculate the intersection bounds
-                            intersection_left = max(src.bounds.left, ref.bounds.left)
-                            intersection_bottom = max(
-                                src.bounds.bottom, ref.bounds.bottom
-                            )
-                            intersection_right = min(src.bounds.right, ref.bounds.right)
-                            intersection_top = min(src.bounds.top, ref.bounds.top)
-
-                            # Convert intersection bounds to a window
-                            if (
-                                intersection_left < intersection_right
-                                and intersection_bottom < intersection_top
-                            ):
-                                
-                                window = rasterio.windows.from_bounds(
-                                    intersection_left,
-                                    intersection_bottom,
-                                    intersection_right,
-                                    intersection_top,
-                                    transform=src.transform,
-                                    width=src.width,
-                                    height=src.height,
-                                )
-
-                                # Read and crop the source raster using the window
-                                cropped_data = src.read(window=window)
-
-                                # Calculate new bounds based on the window
-                                new_left, new_top = window.col_off, window.row_off
-                                new_right, new_bottom = (
-                                    new_left + window.width,
-                                    new_top + window.height,
-                                )
-
-                                # Transform new bounds to map coordinates
-                                new_bounds = (
-                                    src.transform * (new_left, new_top),
-                                    src.transform * (new_right, new_bottom),
-                                )
-
-                                # Extract bound values from the cropped_data
-                                # to get the bounds of the window
-                                left = new_bounds[0][0]
-                                top = new_bounds[0][1]
-                                right = new_bounds[1][0]
-                                bottom = new_bounds[1][1]
-
-                # Loop over each file again to apply the new window bounds
-                for n in aoi_tmp:
-                    path = os.path.join(ground_truth_dir, n)
-
-                    # Open the reference raster
-                    with rasterio.open(path) as src:
-                        window = rasterio.windows.from_bounds(
-                            left,
-                            bottom,
-                            right,
-                            top,
-                            transform=src.transform,
-                            width=src.width,
-                            height=src.height,
-                        )
+    The AOI is reported as locked if another process is merging it, which
+    holds an flock on a lock file next to out_path while it merges. The ground truth and the
+    provenance file are written atomically, the provenance file last, so an
+    interrupted update is repeated by the next run.
 
-                        # Read and crop the source raster using the new window
-                        cropped_data = src.read(window=window)
-
-                        # Create a new raster file for the cropped data
-                        cropped_meta = src.meta.copy()
-                        cropped_meta.update(
-                            {
-                                "height": window.height,
-                                "width": window.width,
-                                "transform": rasterio.windows.transform(
-                                    window, src.transform
-                                ),
-                            }
-                        )
+    Args:
+        event_aoi: EMSR code and AOI, e.g. EMSR264_01AMBILOPE
+        paths: paths to the flood-water masks of the AOI
+        out_path: path to save the merged ground truth
+        ground_truth_bb_fixed_path: directory to store the masks cropped to
+        their shared bounding box, or None to not store them
+        window_size: size in pixels of the output windows processed at once
+        gdal_cachemax_mb: size of the GDAL block cache of the process in MB
+        num_threads: number of COG compression threads, or "ALL_CPUS"
+    Returns:
+        dict with the AOI, its status ("processed", "updated", "skipped",
+        "locked" or "failed"), the path of the ground truth and the traceback of a failure
+    """
+    result = {"event_aoi": event_aoi, "status": "processed", "output": out_path, "error": None}
+
+    folder, name = os.path.split(out_path)
+    lock_path = os.path.join(folder, f".{name}.lock")
+    lock = open(lock_path, "a")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        result["status"] = "locked"
+        return result
+
+    try:
+        # Get the provenance of the existing ground truth
+        provenance = None
+        if os.path.exists(out_path) and os.path.exists(provenance_path(out_path)):
+            with open(provenance_path(out_path)) as f:
+                provenance = json.load(f)
+        inputs = input_provenance(paths, provenance["inputs"] if provenance else None)
+
+        if provenance is not None and inputs == provenance["inputs"]:
+            result["status"] = "skipped"
+            return result
+
+        with rasterio.Env(GDAL_CACHEMAX=gdal_cachemax_mb):
+            # --------------------------------------------------------
+            # Fix bounding boxes with different shapes for each AOI to 
+            # be the same shape. This ensures successful aggregation 
+            # of raster pixels during the merging process.
+            # -------------------------------------------------------- 
+            bounds, windows = common_windows(paths)
+
+            # Save cropped copies of the masks if requested
+            if ground_truth_bb_fixed_path is not None:
+                for path, window in zip(paths, windows):
+                    write_cropped(
+                        path,
+                        window,
+                        os.path.join(ground_truth_bb_fixed_path, os.path.basename(path)),
+                    )
 
-                        # Save the fixed file to ground_truth_bb_fixed folder
-                        out_path = os.path.join(ground_truth_bb_fixed_path, n)
-                        with rasterio.open(out_path, "w", **cropped_meta) as dst:
-                            dst.write(cropped_data)
-
-                            
-                # --------------------------------------------------------------
-                # For each AOI, aggregate land, flood, and water pixels from
-                # all the flood-water masks associated with the AOI to determine
-                # the maximum extent of flood that occured.
-                # --------------------------------------------------------------
-                
-                # Create empty lists for storing land, flood, and water data
-                land_tmp = []
-                flood_tmp = []
-                water_tmp = []
-
-                # Read in the fixed flood-water mask files. Extract land, flood, and water
-                # pixels from each file, then store them in their respective lists.
-                for m in aoi_tmp:
-                    raster_tmp_path = os.path.join(ground_truth_bb_fixed_path, m)
-
-                    src = rasterio.open(raster_tmp_path)
-                    raster = src.read(1)
-                    meta = src.meta
-                    src.close()
-
-                    land = (raster == 1) * 1
-                    land_tmp.append(land)
-                    flood = (raster == 2) * 1
-                    flood_tmp.append(flood)
-                    water = (raster > 2) * 1
-                    water_tmp.append(water)
-
-                # Sum up the values from each pixel stored in each list to generate
-                # a single ground truth image per AOI. A boolean array is used to 
-                # indicate the presence of targeted pixels across all flood-water mask files.
-                land_sum = (sum(land_tmp) >= 1) * 1
-                flood_sum = ((sum(flood_tmp) >= 1) * 1) * 2
-                water_sum = ((sum(water_tmp) >= 1) * 1) * 3
-
-                # Transfer pixel values in water_sum and flood_sum to land_sum and assign 
-                # flood and water pixels as 2 and 3, respectively, in land_sum. We use 
-                # land_sum as the base array because flood values should occupy the pixel 
-                # if there are both flood and land values on the same pixel.
-                land_sum[flood_sum == 2] = 2
-                land_sum[water_sum == 3] = 3
-
-                # Save land_sum array as merged ground truth data in ground_truth_merged folder
-                out_fpath = os.path.join(
-                    ground_truth_merge_dir, i + "_ground_truth_merged.tif"
+            # Masks added since the ground truth was merged, if none of
+            # the merged masks changed or was removed
+            added = None
+            if provenance is not None and np.allclose(bounds, provenance["bounds"]):
+                merged = provenance["inputs"]
+                if all(inputs.get(k, {}).get("sha1") == v["sha1"] for k, v in merged.items()):
+                    added = [
+                        (path, window)
+                        for path, window in zip(paths, windows)
+                        if os.path.basename(path) not in merged
+                    ]
+
+            # ----------------------------------------------------------
+            # Aggregate land, flood, and water pixels from all the
+            # flood-water masks associated with the AOI to determine
+            # the maximum extent of flood that occured. The ground truth
+            # has the land, flood and water pixels of the masks merged
+            # into it, so new masks are merged with it as another mask.
+            # ----------------------------------------------------------
+            if added is not None:
+                with rasterio.open(out_path) as src:
+                    base_window = Window(0, 0, src.width, src.height)
+                if (base_window.height, base_window.width) != (windows[0].height, windows[0].width):
+                    added = None
+
+            if added == []:
+                # Only the modification times of the masks changed
+                result["status"] = "skipped"
+            elif added:
+                reduce_max_extent(
+                    [out_path] + [path for path, _ in added],
+                    [base_window] + [window for _, window in added],
+                    out_path,
+                    window_size=window_size,
+                    num_threads=num_threads,
+                )
+                result["status"] = "updated"
+            else:
+                reduce_max_extent(
+                    paths, windows, out_path, window_size=window_size, num_threads=num_threads
                 )
-                dst = rasterio.open(out_fpath, "w", **meta)
-                dst.write(land_sum, 1)
-                dst.close()
 
-            except:
-                logger.warning(f"failed to generate ground truth for EMSR event {i}")
-                continue
+        with atomic_write(provenance_path(out_path)) as tmp_path:
+            with open(tmp_path, "w") as f:
+                json.dump({"bounds": list(bounds), "inputs": inputs}, f, indent=2, sort_keys=True)
+    except Exception:
+        result["status"] = "failed"
+        result["error"] = traceback.format_exc()
+    finally:
+        # Closing the lock file releases the lock. The operating system also
+        # releases it if the process dies, so a killed worker never leaves
+        # the AOI locked.
+        lock.close()
+
+    return result
+
+
+def generate_ground_truth(
+    ground_truth_dir,
+    ground_truth_merge_dir,
+    ground_truth_bb_fixed_path=None,
+    max_workers=1,
+    gdal_cachemax_mb=256,
+):
+    """
+    Generate ground truth images of EMS activation flood events and permanent water.
+
+    Combine all flood maps for an EMS activation event (e.g. generated on different dates).
+
+    Args:
+        ground_truth_dir: directory of ground truth flood water masks - there can be several
+        EMSR activations per event as the event unfolds over time.
+
+        ground_truth_merge_dir: directory to store merged ground truth flood water masks
+
+        ground_truth_bb_fixed_path: directory to store the flood water masks cropped to
+        the bounding box shared by the masks of each AOI. Cropped masks are only
+        written if it is given; the merge reads the masks in place.
+
+        max_workers: number of processes merging AOIs. AOIs are merged in the
+        calling process if it is 1. Each AOI is merged by one process the same
+        way, so the ground truth does not depend on the number of workers.
+
+        gdal_cachemax_mb: size of the GDAL block cache of each process in MB
+    Returns:
+        list of the results of merge_aoi for each AOI
+    """
+    # Set up output directories
+    if ground_truth_bb_fixed_path is not None:
+        os.makedirs(ground_truth_bb_fixed_path, exist_ok=True)
+    os.makedirs(ground_truth_merge_dir, exist_ok=True)
+
+    # Index the ground truth files by EMSR event and AOI
+    ground_truth_index = index_helpers.ProductIndex.from_dir(ground_truth_dir)
+
+    # Get the flood-water masks of each AOI. AOIs already merged are
+    # skipped or updated by merge_aoi from their provenance.
+    jobs = []
+    for i in sorted(ground_truth_index.by_event_aoi):
+        paths = [
+            os.path.join(ground_truth_dir, z.name) for z in ground_truth_index.by_event_aoi[i]
+        ]
+        out_fpath = os.path.join(ground_truth_merge_dir, i + "_ground_truth_merged.tif")
+        jobs.append((i, paths, out_fpath))
+
+    # Merge the largest AOIs first, so a large AOI started last does
+    # not keep the pool waiting
+    jobs.sort(key=lambda job: sum(os.path.getsize(p) for p in job[1]), reverse=True)
+
+    if max_workers == 1:
+        return [
+            merge_aoi(
+                i, paths, out_fpath, ground_truth_bb_fixed_path, gdal_cachemax_mb=gdal_cachemax_mb
+            )
+            for i, paths, out_fpath in jobs
+        ]
+
+    results = []
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(
+                merge_aoi,
+                i,
+                paths,
+                out_fpath,
+                ground_truth_bb_fixed_path,
+                gdal_cachemax_mb=gdal_cachemax_mb,
+                num_threads=raster_helpers.pool_num_threads(max_workers),
+            ): i
+            for i, paths, out_fpath in jobs
+        }
+        for future in as_completed(futures):
+            # Report a crashed worker as a failed AOI
+            try:
+                result = future.result()
+            except Exception:
+                result = {
+                    "event_aoi": futures[future],
+                    "status": "failed",
+                    "output": None,
+                    "error": traceback.format_exc(),
+                }
+            results.append(result)
+
+    return results
 
 
 if __name__ == "__main__":
@@ -275,17 +477,54 @@ if __name__ == "__main__":
     # Path to ground truth data
     ground_truth_dir = os.path.join(os.getcwd(), "source-data", "ground-truth")
 
-    # Path to ground truth data with fixed bounding boxes
-    ground_truth_bb_fixed_path = os.path.join(
-        os.getcwd(), "source-data", "ground-truth-bb-fixed"
-    )
+    # Path to save ground truth data cropped to fixed bounding boxes,
+    # or None to merge the ground truth data without cropped copies
+    ground_truth_bb_fixed_path = None
 
     # Path to merged ground truth data
     ground_truth_merge_dir = os.path.join(
         os.getcwd(), "source-data", "ground-truth-merged"
     )
 
-    # Run the generate_ground_truth function
-    generate_ground_truth(ground_truth_dir, ground_truth_merge_dir)
+    # Size of the GDAL block cache and estimated peak memory of a
+    # worker in MB, used to choose the number of workers
+    gdal_cachemax_mb = 256
+    worker_memory_mb = 1024
+
+    # Run the generate_ground_truth function, merging AOIs
+    # across a pool of processes, as many as fit in memory
+    workers = memory_aware_workers(worker_memory_mb)
+    logger.info(f"merging ground truth with {workers} workers")
+
+    results = generate_ground_truth(
+        ground_truth_dir,
+        ground_truth_merge_dir,
+        ground_truth_bb_fixed_path,
+        max_workers=workers,
+        gdal_cachemax_mb=gdal_cachemax_mb,
+    )
+
+    for result in sorted(results, key=lambda r: r["event_aoi"]):
+        if result["status"] == "processed":
+            logger.info(f"ground truth for EMSR event {result['event_aoi']} saved to {result['output']}")
+        elif result["status"] == "updated":
+            logger.info(f"ground truth for EMSR event {result['event_aoi']} updated with new masks")
+        elif result["status"] == "skipped":
+            logger.info(f"ground truth for EMSR event {result['event_aoi']} already generated")
+        elif result["status"] == "locked":
+            logger.warning(
+                f"ground truth for EMSR event {result['event_aoi']} is being generated by another process"
+            )
+        else:
+            logger.warning(
+                f"failed to generate ground truth for EMSR event {result['event_aoi']}\n{result['error']}"
+            )
+
+    failed = [r["event_aoi"] for r in results if r["status"] == "failed"]
+    locked = [r["event_aoi"] for r in results if r["status"] == "locked"]
+    logger.info(
+        f"{len(results) - len(failed) - len(locked)} AOIs merged, updated or skipped, "
+        f"{len(locked)} locked by another process, {len(failed)} failed"
+    )
 
     logger.info("**** finished ****")
\ No newline at end of file
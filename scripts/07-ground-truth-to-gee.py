@@ -4,12 +4,13 @@ import pandas as pd
 
 # Get merged ground truth files
 ground_truth_merge_dir = os.path.join(os.getcwd(), "source-data", "ground-truth-merged")
-ground_truth_files = os.listdir(ground_truth_merge_dir)
+ground_truth_files = sorted(f for f in os.listdir(ground_truth_merge_dir) if f.endswith(".tif"))
 
-# Get the list of EMSR activations
+# Get the list of EMSR activations, indexed by EMSR code
 df = pd.read_csv(
     os.path.join(os.getcwd(), "source-data", "Copernicus_EMS_table", "tropical_ems_event_date.csv")
     )
+event_dates = df.drop_duplicates("Code").set_index("Code")["EventDate"]
 
 # Upload the images to GEE
 for i in ground_truth_files:
@@ -19,7 +20,7 @@ for i in ground_truth_files:
     # Get event ID and event date
     event_aoi = i.split("_ground")[0]
     event_id = event_aoi.split("_")[0]
-    event_date = df.loc[df["Code"] == event_id, "EventDate"].to_list()[0]
+    event_date = event_dates[event_id]
     
     # Set metadata properties for the GEE assets
     date_command = f"earthengine asset set -p '(string)event_date={event_date}' projects/fiji-s2-image-stack/assets/tropical-floods-ground-truth/{prefix}"
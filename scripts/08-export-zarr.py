@@ -0,0 +1,292 @@
+# Import modules
+import os
+import logging
+import traceback
+import numpy as np
+import pandas as pd
+import xarray as xr
+import rioxarray  # registers the .rio accessor on xarray objects
+import rasterio
+import zarr
+import dask.array as da
+
+from numcodecs import Blosc
+from rasterio.windows import Window
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from utils import product_index as index_helpers
+from utils import catalog_utils as catalog_helpers
+from utils import raster_utils as raster_helpers
+
+# Size of the square chunks of the masks in pixels. Each chunk of a
+# mask is one product of one AOI, so a patch read touches only the
+# chunks under the patch.
+CHUNK_SIZE = 512
+
+# Compressor of the mask chunks
+COMPRESSOR = Blosc(cname="zstd", clevel=5, shuffle=Blosc.BITSHUFFLE)
+
+
+# ---------------------------------------------------------------
+# Export the flood-water masks of each AOI into a group of a
+# chunked, compressed Zarr store. The masks of an AOI are stacked
+# along a product dimension on the grid covering all of them,
+# with the satellite date of each product as a coordinate.
+# ---------------------------------------------------------------
+
+def _write_mask(src, placement, width, height, store_path, group, variable, index=None):
+    """
+    Write a mask into a Zarr array on a grid of width x height pixels, one
+    chunk at a time. Each chunk of the grid overlapping the mask is written
+    whole, with 0 outside the mask, so no chunk is read back and rewritten.
+    Chunks not overlapping the mask are not written and read as the fill
+    value 0.
+    """
+    dims = ("y", "x") if index is None else ("product", "y", "x")
+    for row_off in range(0, height, CHUNK_SIZE):
+        chunk_height = min(CHUNK_SIZE, height - row_off)
+        # Rows of the chunk covered by the mask
+        top = max(row_off, placement.row_off)
+        bottom = min(row_off + chunk_height, placement.row_off + placement.height)
+        if top >= bottom:
+            continue
+        for col_off in range(0, width, CHUNK_SIZE):
+            chunk_width = min(CHUNK_SIZE, width - col_off)
+            # Columns of the chunk covered by the mask
+            left = max(col_off, placement.col_off)
+            right = min(col_off + chunk_width, placement.col_off + placement.width)
+            if left >= right:
+                continue
+
+            data = np.zeros((chunk_height, chunk_width), dtype=np.uint8)
+            data[top - row_off : bottom - row_off, left - col_off : right - col_off] = src.read(
+                1,
+                window=Window(
+                    left - placement.col_off, top - placement.row_off, right - left, bottom - top
+                ),
+            )
+            region = {
+                "y": slice(row_off, row_off + chunk_height),
+                "x": slice(col_off, col_off + chunk_width),
+            }
+            if index is not None:
+                data = data[np.newaxis]
+                region["product"] = slice(index, index + 1)
+            xr.Dataset({variable: (dims, data)}).to_zarr(
+                store_path, group=group, region=region
+            )
+
+
+def export_aoi(event_aoi, masks, store_path, merged_path=None, attrs=None):
+    """
+    Export the flood-water masks of an AOI to a group of a Zarr store.
+
+    The group holds a mask variable with dims (product, y, x) and, if
+    merged_path is given, a merged variable with dims (y, x), on the grid
+    covering all the masks. Pixels outside a mask are 0 (invalid). The
+    masks are written region by region, so memory use does not depend on
+    the size of the AOI. Groups of different AOIs can be written in
+    parallel.
+
+    Args:
+        event_aoi: EMSR code and AOI, e.g. EMSR264_01AMBILOPE, used as the group name
+        masks: list of (product name, satellite date, path) of the masks
+        store_path: path to the Zarr store
+        merged_path: path to the merged ground truth of the AOI
+        attrs: attributes of the AOI, e.g. its event date and country
+    Returns:
+        dict with the AOI, its status ("processed" or "failed"), the number
+        of masks written and the traceback of a failure
+    """
+    result = {"event_aoi": event_aoi, "status": "processed", "masks": 0, "error": None}
+    paths = [path for _, _, path in masks] + ([merged_path] if merged_path else [])
+    sources = []
+    try:
+        sources = [rasterio.open(p) for p in paths]
+        transform, width, height, placements = raster_helpers.union_grid(sources)
+
+        # Pixel centre coordinates of the grid
+        x = transform.c + (np.arange(width) + 0.5) * transform.a
+        y = transform.f + (np.arange(height) + 0.5) * transform.e
+
+        # Create the group with empty arrays, written by chunk below.
+        # Chunks never written read as the fill value 0 (invalid).
+        data_vars = {
+            "mask": (
+                ("product", "y", "x"),
+                da.zeros(
+                    (len(masks), height, width),
+                    dtype=np.uint8,
+                    chunks=(1, CHUNK_SIZE, CHUNK_SIZE),
+                ),
+            )
+        }
+        if merged_path:
+            data_vars["merged"] = (
+                ("y", "x"),
+                da.zeros((height, width), dtype=np.uint8, chunks=(CHUNK_SIZE, CHUNK_SIZE)),
+            )
+        ds = xr.Dataset(
+            data_vars,
+            coords={
+                "product": [name for name, _, _ in masks],
+                "satellite_date": ("product", pd.to_datetime([d for _, d, _ in masks])),
+                "y": y,
+                "x": x,
+            },
+            attrs={k: str(v) for k, v in (attrs or {}).items()},
+        )
+        ds = ds.rio.write_crs(sources[0].crs).rio.write_transform(transform)
+        encoding = {
+            variable: {"compressor": COMPRESSOR, "fill_value": 0} for variable in data_vars
+        }
+        ds.to_zarr(
+            store_path,
+            group=event_aoi,
+            mode="w",
+            compute=False,
+            encoding=encoding,
+            consolidated=False,
+        )
+
+        for k, (src, placement) in enumerate(zip(sources[: len(masks)], placements)):
+            _write_mask(src, placement, width, height, store_path, event_aoi, "mask", index=k)
+            result["masks"] += 1
+        if merged_path:
+            _write_mask(
+                sources[-1], placements[-1], width, height, store_path, event_aoi, "merged"
+            )
+    except Exception:
+        result["status"] = "failed"
+        result["error"] = traceback.format_exc()
+    finally:
+        for src in sources:
+            src.close()
+
+    return result
+
+
+if __name__ == "__main__":
+
+    # ----------------------------------------------------------
+    # Set up a logger.
+    # ----------------------------------------------------------
+
+    # Create a custom logger
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.DEBUG)
+
+    # Create handlers
+    f_handler = logging.FileHandler("08-export-zarr.log")
+
+    # Create formatters and add it to handlers
+    f_format = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    f_handler.setFormatter(f_format)
+
+    # Add handlers to the logger
+    logger.addHandler(f_handler)
+
+    # ---------------------------------------------
+    # Create paths to the flood-water masks, merged
+    # ground truth, metadata and the Zarr store
+    # ---------------------------------------------
+
+    # Path to ground truth data
+    ground_truth_dir = os.path.join(os.getcwd(), "source-data", "ground-truth")
+
+    # Path to merged ground truth data
+    ground_truth_merge_dir = os.path.join(os.getcwd(), "source-data", "ground-truth-merged")
+
+    # Path to the catalog of vector products and the table of
+    # EMS activations with event dates
+    folder_metadata = os.path.join(os.getcwd(), "source-data", "Copernicus_EMS_metadata")
+    folder_csv_ems = os.path.join(os.getcwd(), "source-data", "Copernicus_EMS_table")
+
+    # Path to the Zarr store
+    store_path = os.path.join(os.getcwd(), "source-data", "ground-truth.zarr")
+
+    # Number of processes writing AOIs
+    zarr_workers = os.cpu_count()
+
+    # ------------------------------------------------
+    # Get the masks and attributes of each AOI. Masks
+    # are matched to the catalog on their parsed names.
+    # ------------------------------------------------
+
+    catalog = catalog_helpers.read_catalog(
+        os.path.join(folder_metadata, "catalog.parquet"), columns=["name", "satellite_date"]
+    )
+    satellite_dates = {
+        index_helpers.parse_product_name(name).key: date
+        for name, date in zip(catalog["name"], catalog["satellite_date"])
+    }
+
+    ems_df = pd.read_csv(os.path.join(folder_csv_ems, "tropical_ems_event_date.csv"))
+    ems_df = ems_df.drop_duplicates("Code").set_index("Code")
+
+    ground_truth_index = index_helpers.ProductIndex.from_dir(ground_truth_dir, suffix=".tif")
+    merged_index = (
+        index_helpers.ProductIndex.from_dir(ground_truth_merge_dir, suffix=".tif")
+        if os.path.isdir(ground_truth_merge_dir)
+        else index_helpers.ProductIndex([])
+    )
+
+    jobs = []
+    for event_aoi, products in sorted(ground_truth_index.by_event_aoi.items()):
+        masks = [
+            (p.stem, satellite_dates.get(p.key), os.path.join(ground_truth_dir, p.name))
+            for p in products
+        ]
+        merged = merged_index.by_event_aoi.get(event_aoi)
+        merged_path = os.path.join(ground_truth_merge_dir, merged[0].name) if merged else None
+
+        code = products[0].code
+        attrs = {"ems_code": code, "aoi": products[0].aoi}
+        if code in ems_df.index:
+            attrs.update(
+                {
+                    "event_date": ems_df.loc[code, "EventDate"],
+                    "activation_date": ems_df.loc[code, "CodeDate"],
+                    "country": ems_df.loc[code, "Country"],
+                    "title": ems_df.loc[code, "Title"],
+                }
+            )
+        jobs.append((event_aoi, masks, merged_path, attrs))
+
+    # -------------------------------------------------
+    # Write the AOIs in parallel. Each AOI is a separate
+    # group, so workers never write the same chunks.
+    # -------------------------------------------------
+
+    zarr.open_group(store_path, mode="a")
+
+    results = []
+    with ProcessPoolExecutor(max_workers=zarr_workers) as pool:
+        futures = {
+            pool.submit(export_aoi, event_aoi, masks, store_path, merged_path, attrs): event_aoi
+            for event_aoi, masks, merged_path, attrs in jobs
+        }
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception:
+                result = {
+                    "event_aoi": futures[future],
+                    "status": "failed",
+                    "masks": 0,
+                    "error": traceback.format_exc(),
+                }
+            results.append(result)
+
+            if result["status"] == "processed":
+                logger.info(f"exported {result['masks']} masks of {result['event_aoi']}")
+            else:
+                logger.error(f"failed to export {result['event_aoi']}\n{result['error']}")
+
+    # Consolidate the metadata of all groups so opening the store
+    # reads a single metadata file
+    zarr.consolidate_metadata(store_path)
+
+    failed = [r["event_aoi"] for r in results if r["status"] == "failed"]
+    logger.info(f"{len(results) - len(failed)} AOIs exported, {len(failed)} failed")
+
+    logger.info("**** finished ****")
@@ -0,0 +1,207 @@
+# Import modules
+import os
+import time
+import shutil
+import tempfile
+import importlib
+import tracemalloc
+import numpy as np
+import geopandas as gpd
+import rasterio
+
+from affine import Affine
+from rasterio import features
+from shapely.geometry import box, Point
+
+# Benchmark compute_water in 05-generate-flood-water-masks.py against the
+# previous implementation, which copied the flood map, rasterised the
+# whole image twice and masked it with full-size boolean temporaries.
+# Run from the scripts folder. Times are wall clock seconds per event and
+# allocations are the peak of numpy and Python allocations traced by
+# tracemalloc (GDAL's own buffers are not traced).
+
+# Size in pixels of the synthetic static image, number of flood polygons
+# and number of vertices of each polygon
+image_size = 4096
+n_polygons = 2000
+polygon_resolution = 64
+
+# Number of runs of each implementation
+n_runs = 3
+
+water_masks = importlib.import_module("05-generate-flood-water-masks")
+
+
+# ---------------------------------------------------------
+# Previous implementation of compute_water, kept as the
+# baseline of the benchmark and to check identical outputs
+# ---------------------------------------------------------
+
+def compute_water_baseline(floodmap, permanent_water_path, keep_streams, out_path):
+    floodmap = floodmap.copy()
+
+    with rasterio.open(permanent_water_path) as src:
+        out_shape = src.shape
+        transform = src.transform
+        target_crs = src.crs
+
+    if str(floodmap.crs).lower() != target_crs:
+        floodmap.to_crs(crs=target_crs, inplace=True)
+
+    floodmap_aoi = floodmap[floodmap["w_class"] == "area_of_interest"]
+    floodmap_rasterise = floodmap.copy()
+    if floodmap_aoi.shape[0] > 0:
+        floodmap_rasterise = floodmap_rasterise[
+            floodmap_rasterise["w_class"] != "area_of_interest"
+        ]
+    if not keep_streams:
+        floodmap_rasterise = floodmap_rasterise[floodmap_rasterise["source"] != "hydro_l"]
+
+    shapes_rasterise = (
+        (g, water_masks.CODES_FLOODMAP[w])
+        for g, w in floodmap_rasterise[["geometry", "w_class"]].itertuples(
+            index=False, name=None
+        )
+        if g and not g.is_empty
+    )
+    water_mask = features.rasterize(
+        shapes=shapes_rasterise,
+        fill=1,
+        out_shape=out_shape,
+        dtype=np.uint8,
+        transform=transform,
+        all_touched=keep_streams,
+    )
+
+    if floodmap_aoi.shape[0] > 0:
+        shapes_rasterise = (
+            (g, 1)
+            for g, w in floodmap_aoi[["geometry", "w_class"]].itertuples(
+                index=False, name=None
+            )
+            if g and not g.is_empty
+        )
+        valid_mask = features.rasterize(
+            shapes=shapes_rasterise,
+            fill=0,
+            out_shape=out_shape,
+            dtype=np.uint8,
+            transform=transform,
+            all_touched=True,
+        )
+        water_mask[valid_mask == 0] = 0
+
+    with rasterio.open(permanent_water_path) as src:
+        permanent_water = src.read(2)
+        out_meta = src.meta
+
+    water_mask[(water_mask != 0) & (permanent_water == 80)] = 3
+
+    out_meta["driver"] = "GTiff"
+    out_meta["count"] = 1
+    out_meta["dtype"] = np.uint8
+
+    with rasterio.open(out_path, "w", **out_meta) as dst:
+        dst.write(water_mask, 1)
+
+
+# ---------------------------------------------------
+# Create a synthetic static image and flood map
+# ---------------------------------------------------
+
+def make_event(folder, image_size, n_polygons, polygon_resolution=16, seed=0):
+    """
+    Create a two band static image and a flood map with an AOI polygon and
+    random flood and hydrography polygons over it.
+    """
+    rng = np.random.default_rng(seed)
+    pixel_size = 10 / 111319.49079327357
+    transform = Affine(pixel_size, 0, 178.0, 0, -pixel_size, -17.0)
+    extent = image_size * pixel_size
+
+    static_image_path = os.path.join(folder, "EMSR000_01TEST_DEL_v1_static_images.tif")
+    land_cover = np.where(rng.random((image_size, image_size)) < 0.05, 80, 10)
+    profile = {
+        "driver": "GTiff",
+        "dtype": "int32",
+        "count": 2,
+        "width": image_size,
+        "height": image_size,
+        "crs": "EPSG:4326",
+        "transform": transform,
+        "tiled": True,
+        "blockxsize": 256,
+        "blockysize": 256,
+    }
+    with rasterio.open(static_image_path, "w", **profile) as dst:
+        dst.write(np.zeros((image_size, image_size), dtype=np.int32), 1)
+        dst.write(land_cover.astype(np.int32), 2)
+
+    left, top = transform.c, transform.f
+    aoi = box(left + 0.05 * extent, top - 0.95 * extent, left + 0.95 * extent, top - 0.05 * extent)
+    classes = ["Flooded area", "River", "BH080-Lake", "BA030-Island", "Flood trace"]
+
+    records = [{"geometry": aoi, "w_class": "area_of_interest", "source": "area_of_interest"}]
+    for _ in range(n_polygons):
+        x = left + rng.random() * extent
+        y = top - rng.random() * extent
+        radius = rng.random() * 0.02 * extent
+        w_class = classes[rng.integers(len(classes))]
+        records.append(
+            {
+                "geometry": Point(x, y).buffer(radius, resolution=polygon_resolution),
+                "w_class": w_class,
+                "source": "hydro_l" if w_class == "River" else "flood",
+            }
+        )
+    floodmap = gpd.GeoDataFrame(records, geometry="geometry", crs="EPSG:4326")
+
+    return floodmap, static_image_path
+
+
+def run(func, floodmap, static_image_path, out_path, **kwargs):
+    tracemalloc.start()
+    start = time.perf_counter()
+    func(floodmap, static_image_path, True, out_path, **kwargs)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+if __name__ == "__main__":
+    folder = tempfile.mkdtemp()
+    try:
+        floodmap, static_image_path = make_event(folder, image_size, n_polygons, polygon_resolution)
+
+        implementations = {
+            "baseline": (compute_water_baseline, {}),
+            "whole image": (water_masks.compute_water, {"windowed": False}),
+            "windowed": (water_masks.compute_water, {"windowed": True}),
+            "simplified": (
+                water_masks.compute_water,
+                {"windowed": True, "simplify_tolerance": 0.25},
+            ),
+        }
+
+        results = {}
+        for label, (func, kwargs) in implementations.items():
+            out_path = os.path.join(folder, label.replace(" ", "_") + ".tif")
+            runs = [run(func, floodmap, static_image_path, out_path, **kwargs) for _ in range(n_runs)]
+            results[label] = (min(r[0] for r in runs), max(r[1] for r in runs), out_path)
+
+        # Check that every implementation writes the same ground truth.
+        # Simplified geometries may differ by a few boundary pixels.
+        with rasterio.open(results["baseline"][2]) as src:
+            expected = src.read(1)
+        for label, (_, _, out_path) in results.items():
+            with rasterio.open(out_path) as src:
+                differing = np.count_nonzero(src.read(1) != expected)
+            print(f"{label:<12} pixels differing from baseline: {differing}")
+
+        print(f"{image_size} x {image_size} pixels, {n_polygons} polygons, best of {n_runs} runs")
+        print(f"{'':<12} {'seconds':>8} {'peak MB':>8}")
+        for label, (elapsed, peak, _) in results.items():
+            print(f"{label:<12} {elapsed:8.2f} {peak / 2 ** 20:8.1f}")
+    finally:
+        shutil.rmtree(folder)
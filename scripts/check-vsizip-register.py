@@ -0,0 +1,74 @@
+# Import modules
+import os
+import sys
+import glob
+import shutil
+import tempfile
+import pandas as pd
+
+from ml4floods.data.copernicusEMS import activations
+from utils import product_index as index_helpers
+from utils import vector_utils as vector_helpers
+
+# Check that registering the EMS vector products read inside their zip
+# files (extract_zips = False in 00-download-ems-vectors.py) gives the
+# same metadata as extracting them and registering them with ml4floods.
+# Run from the scripts folder after 00-download-ems-vectors.py. Prints
+# the fields that differ for each product and exits with status 1 if
+# any product differs.
+
+# Folder of the downloaded zip files and table of EMS activations
+folder_raw = os.path.join(os.getcwd(), "source-data", "Copernicus_EMS_raw")
+folder_csv_ems = os.path.join(os.getcwd(), "source-data", "Copernicus_EMS_table")
+
+
+def compare_registers(extracted, zipped):
+    """
+    Get the fields that differ between the metadata of an extracted product
+    and of the same product read inside its zip file. The folder of the
+    files differs by design and is not compared.
+    """
+    if extracted is None or zipped is None:
+        return [] if extracted is zipped else ["<registered>"]
+
+    differing = []
+    for key in sorted(set(extracted) | set(zipped)):
+        if key == "folder_files":
+            continue
+        if key not in extracted or key not in zipped:
+            differing.append(key)
+        elif key == "area_of_interest_polygon":
+            if not extracted[key].equals(zipped[key]):
+                differing.append(key)
+        elif extracted[key] != zipped[key]:
+            differing.append(key)
+
+    return differing
+
+
+if __name__ == "__main__":
+    ems_df = pd.read_csv(os.path.join(folder_csv_ems, "tropical_ems.csv"))
+    code_dates = dict(zip(ems_df["Code"], ems_df["CodeDate"]))
+
+    n_differing = 0
+    zip_files = sorted(glob.glob(os.path.join(folder_raw, "*.zip")))
+    folder = tempfile.mkdtemp()
+    try:
+        for zip_file in zip_files:
+            code_date = code_dates.get(index_helpers.parse_product_name(zip_file).code)
+            if code_date is None:
+                continue
+
+            unzip_folder = activations.unzip_copernicus_ems(zip_file, folder_out=folder)
+            extracted = activations.filter_register_copernicusems(unzip_folder, code_date)
+            zipped = vector_helpers.register_copernicusems_zip(zip_file, code_date)
+
+            differing = compare_registers(extracted, zipped)
+            if differing:
+                n_differing += 1
+                print(f"{os.path.basename(zip_file)}: {', '.join(differing)}")
+    finally:
+        shutil.rmtree(folder)
+
+    print(f"{len(zip_files)} zip files, {n_differing} with differing metadata")
+    sys.exit(1 if n_differing else 0)
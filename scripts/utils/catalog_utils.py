@@ -0,0 +1,124 @@
+import os
+import json
+import pandas as pd
+import geopandas as gpd
+
+from utils import floodmap_store
+from utils.utils import atomic_write
+
+# Types of the catalog columns, besides the AOI polygon geometry
+CATALOG_DTYPES = {
+    "name": "string",
+    "event_id": "string",
+    "ems_code": "string",
+    "aoi_code": "string",
+    "product": "string",
+    "monit": "string",
+    "version": "Int64",
+    "satellite_date": "datetime64[ns]",
+    "activation_date": "datetime64[ns]",
+    "country": "string",
+    "title": "string",
+    "static_image": "string",
+    "vector_path": "string",
+    "minx": "float64",
+    "miny": "float64",
+    "maxx": "float64",
+    "maxy": "float64",
+}
+
+
+def build_catalog(store_dir, activations_table, catalog_path):
+    """
+    Build the catalog of EMS vector products from the metadata of the
+    GeoParquet store and the table of EMS activations.
+
+    The catalog has one row per vector product with typed columns for the
+    EMSR code, AOI, product, dates, country, AOI polygon and bounds and the
+    paths of the vector product, sorted by product name. It is written
+    atomically as a single GeoParquet file, so later stages read it once
+    instead of loading a metadata file per product.
+
+    Args:
+        store_dir (str): Folder of the GeoParquet store.
+        activations_table (pd.DataFrame): Table of EMS activations from
+            utils.table_floods_ems, indexed by Code.
+        catalog_path (str): Path to save the catalog.
+
+    Returns:
+        gpd.GeoDataFrame: The catalog, indexed by event id.
+    """
+    metadata = floodmap_store.read_metadata(store_dir)
+    metadata = metadata.sort_values("name").reset_index(drop=True)
+
+    catalog = gpd.GeoDataFrame(
+        {
+            "name": metadata["name"],
+            "event_id": metadata["event_id"],
+            "ems_code": metadata["event_id"].str.split("_").str[0],
+            "aoi_code": metadata["aoi_code"],
+            "product": metadata["product"],
+            "monit": metadata["monit"],
+            "version": metadata["version"],
+            "satellite_date": metadata["satellite_date"],
+        },
+        geometry=metadata.geometry,
+        crs=floodmap_store.STORE_CRS,
+    )
+
+    # Activation date, country and title of the EMSR code
+    activations_table = activations_table[~activations_table.index.duplicated()]
+    catalog["activation_date"] = pd.to_datetime(
+        catalog["ems_code"].map(activations_table["CodeDate"])
+    )
+    catalog["country"] = catalog["ems_code"].map(activations_table["Country"])
+    catalog["title"] = catalog["ems_code"].map(activations_table["Title"])
+
+    # Name of the static image exported for the product in 01-download-images.py
+    catalog["static_image"] = catalog["event_id"] + "_static_images"
+
+    # Folder or /vsizip/ path of the shapefiles of the vector product
+    catalog["vector_path"] = [
+        json.loads(m).get("folder_files") for m in metadata["metadata_json"]
+    ]
+
+    bounds = catalog.geometry.bounds
+    for column in ["minx", "miny", "maxx", "maxy"]:
+        catalog[column] = bounds[column]
+
+    for column, dtype in CATALOG_DTYPES.items():
+        if dtype.startswith("datetime"):
+            catalog[column] = pd.to_datetime(catalog[column])
+        else:
+            catalog[column] = catalog[column].astype(dtype)
+
+    os.makedirs(os.path.dirname(catalog_path), exist_ok=True)
+    with atomic_write(catalog_path) as tmp_path:
+        catalog.to_parquet(tmp_path, index=False)
+
+    return catalog.set_index("event_id", drop=False)
+
+
+def read_catalog(catalog_path, columns=None, ems_codes=None):
+    """
+    Read the catalog of EMS vector products.
+
+    Args:
+        catalog_path (str): Path to the catalog from build_catalog.
+        columns (list): Columns to read. The AOI polygons are read as a
+            GeoDataFrame if geometry is in columns.
+        ems_codes (list): Only read products of these EMSR codes.
+
+    Returns:
+        pd.DataFrame: One row per vector product, indexed by event id.
+    """
+    if columns is not None and "event_id" not in columns:
+        columns = ["event_id"] + list(columns)
+    filters = [("ems_code", "in", list(ems_codes))] if ems_codes is not None else None
+
+    if columns is None or "geometry" in columns:
+        catalog = gpd.read_parquet(catalog_path, columns=columns, filters=filters)
+    else:
+        catalog = pd.read_parquet(catalog_path, columns=columns, filters=filters)
+
+    return catalog.set_index("event_id", drop=False)
@@ -0,0 +1,79 @@
+import os
+import numpy as np
+import geopandas as gpd
+
+from shapely.geometry import box
+
+# Tropics and sub-tropics band used to filter EMS activations
+TROPICS = box(-179.99, -23.5, 179.99, 23.5)
+
+# Cached FAO GAUL 2015 country boundaries (level 0). Build it once with
+# gee_utils.download_country_boundaries, after which the tropical
+# country filter runs offline.
+COUNTRY_BOUNDARIES_PATH = os.path.join(
+    os.getcwd(), "source-data", "country-boundaries", "FAO_GAUL_2015_level0.parquet"
+)
+
+# Column of the country names in the boundaries layer
+COUNTRY_NAME_COLUMN = "ADM0_NAME"
+
+
+def load_country_boundaries(path=COUNTRY_BOUNDARIES_PATH):
+    """
+    Load the cached country boundaries.
+
+    Args:
+        path (str): Path to the GeoParquet file of country boundaries.
+
+    Returns:
+        gpd.GeoDataFrame: Country boundaries in EPSG:4326 with a spatial index.
+    """
+    boundaries = gpd.read_parquet(path)
+    if boundaries.crs is not None:
+        boundaries = boundaries.to_crs("EPSG:4326")
+    return boundaries
+
+
+def get_tropical_countries(country_list, boundaries=None):
+    """
+    Get a list of tropical countries from the cached country boundaries.
+    Filter out non-tropical EMS activations.
+
+    Offline counterpart of gee_utils.get_tropical_countries. Countries whose
+    boundaries intersect the tropics band are found with an STRtree query
+    on the boundaries' spatial index.
+
+    Args:
+        country_list (List): List of countries with EMS flood and storm activations.
+        boundaries (gpd.GeoDataFrame): Country boundaries. Loaded from
+            COUNTRY_BOUNDARIES_PATH if not given.
+
+    Returns:
+        List: Countries in country_list that are in the tropics.
+    """
+    if boundaries is None:
+        boundaries = load_country_boundaries()
+
+    tropics_index = boundaries.sindex.query(TROPICS, predicate="intersects")
+    tropics_countries_set = set(
+        boundaries[COUNTRY_NAME_COLUMN].iloc[tropics_index].tolist()
+    )
+
+    in_tropics = set(country_list).intersection(tropics_countries_set)
+
+    return list(in_tropics)
+
+
+def in_tropics(geometries):
+    """
+    Test which geometries intersect the tropics band, e.g. the AOI
+    polygons of EMS activations.
+
+    Args:
+        geometries (list): Shapely geometries in EPSG:4326.
+
+    Returns:
+        np.ndarray: Boolean array, True for geometries in the tropics.
+    """
+    geometries = gpd.GeoSeries(list(geometries), crs="EPSG:4326")
+    return np.asarray(geometries.intersects(TROPICS))
@@ -0,0 +1,342 @@
+import os
+import re
+import json
+import shutil
+import zipfile
+import logging
+import threading
+
+from bs4 import BeautifulSoup, SoupStrainer
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+from utils import http_cache
+from utils.utils import with_retries
+from ml4floods.data.copernicusEMS import activations
+
+logger = logging.getLogger(__name__)
+
+# Host serving the EMS activation component pages queried by
+# fetch_zip_file_urls
+EMS_COMPONENTS_HOST = "emergency.copernicus.eu"
+EMS_COMPONENTS_URL = f"https://{EMS_COMPONENTS_HOST}/mapping/list-of-components/"
+
+
+def is_vector_product(zip_file):
+    """
+    Check if a zip file holds a vector product used to generate flood extent.
+
+    Filter out vector products, including First Estimate Products (FEP),
+    Delineation Products (DEP) and Grading Products (GRA). The RTP products
+    are the same but with a printable map. The documentation describing each
+    product can be found in the link below:
+    https://emergency.copernicus.eu/mapping/sites/default/files/files/EMS_Mapping_Manual_of_Procedures_v2_September2020.pdf
+
+    Args:
+        zip_file (str): URL or path of the zip file.
+
+    Returns:
+        bool: True if the zip file is a FEP, DEL or GRA product.
+    """
+    return bool(
+        (re.search("FEP", zip_file))
+        or (re.search("DEL", zip_file))
+        or (re.search("DELINEATION", zip_file))
+        or (re.search("GRA", zip_file))
+        or (re.search("GRADING", zip_file))
+    )
+
+
+class DownloadJournal:
+    """
+    Append-only JSON lines journal of completed steps of an EMS download run.
+
+    Each line records either the zip file URLs listed for an EMSR code or a
+    zip file that was downloaded and unzipped. Reloading the journal lets a
+    crashed run resume without fetching completed steps again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.zip_urls = {}
+        self.unzipped = {}
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Ignore a partially written last line from a crashed run
+                        continue
+                    if "urls" in record:
+                        self.zip_urls[record["code"]] = record["urls"]
+                    elif "unzipped" in record:
+                        self.unzipped[record["url"]] = record["unzipped"]
+
+    def _append(self, record):
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def record_urls(self, code, urls):
+        self.zip_urls[code] = urls
+        self._append({"code": code, "urls": urls})
+
+    def record_unzipped(self, code, url, unzipped):
+        self.unzipped[url] = unzipped
+        self._append({"code": code, "url": url, "unzipped": unzipped})
+
+
+class _HostLimiter:
+    """
+    Limit the number of concurrent requests made to each host.
+    """
+
+    def __init__(self, max_per_host):
+        self.max_per_host = max_per_host
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, url):
+        host = urlparse(url).netloc or url
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self._semaphores[host]
+
+
+def fetch_zip_file_urls(session, code, timeout=60):
+    """
+    Get the URLs of the zip files of an EMS activation from its list of
+    components page.
+
+    Counterpart of activations.fetch_zip_file_urls that sends the request
+    through session, so it is pooled, recorded and replayed like the other
+    requests of a run. Reference maps and RTP01 products are left out as in
+    ml4floods.
+
+    Args:
+        session (requests.Session): Session to send the request with.
+        code (str): EMSR code of the activation, e.g. EMSR502.
+        timeout (int): Timeout in seconds for connecting and reading.
+
+    Returns:
+        list: URLs of the zip files of the activation.
+    """
+    r = session.get(EMS_COMPONENTS_URL + code, timeout=timeout)
+    r.raise_for_status()
+
+    soup = BeautifulSoup(r.content, "lxml", parse_only=SoupStrainer("a", href=True))
+    return [
+        f"https://{EMS_COMPONENTS_HOST}" + a["href"]
+        for a in soup.find_all("a")
+        if "zip" in a["href"]
+        and "REFERENCE_MAP" not in a["href"]
+        and "RTP01" not in a["href"]
+    ]
+
+
+def is_downloadable(session, url, timeout=60):
+    """
+    Check if a URL serves a file rather than an HTML page, e.g. the
+    Copernicus EMS disclaimer form served before some zip files.
+
+    Counterpart of activations.is_downloadable that sends the request
+    through session.
+
+    Args:
+        session (requests.Session): Session to send the request with.
+        url (str): URL of the file.
+        timeout (int): Timeout in seconds for connecting and reading.
+
+    Returns:
+        bool: False if the URL serves an HTML page.
+    """
+    h = session.head(url, allow_redirects=True, timeout=timeout)
+    content_type = h.headers.get("Content-Type", "").lower()
+    return "text" not in content_type or "html" not in content_type
+
+
+def download_file(session, url, folder_out, timeout=60):
+    """
+    Stream a zip file to disk. The file is written to a .part file and only
+    renamed to its final name once complete and a valid zip file.
+
+    As in activations.download_vector_cems, URLs that serve the Copernicus
+    EMS disclaimer page instead of the file are downloaded by submitting
+    the disclaimer form.
+
+    Args:
+        session (requests.Session): Session to download with.
+        url (str): URL of the file.
+        folder_out (str): Folder to save the file in.
+        timeout (int): Timeout in seconds for connecting and reading.
+
+    Returns:
+        str: Path to the downloaded file.
+
+    Raises:
+        ValueError: If the downloaded file is not a zip file, e.g. an HTML
+            page. Nothing is left on disk, so a retry downloads it again.
+    """
+    file_path_out = os.path.join(folder_out, os.path.basename(url))
+    if os.path.exists(file_path_out):
+        if zipfile.is_zipfile(file_path_out):
+            return file_path_out
+        # Remove an invalid file saved by an earlier run
+        os.remove(file_path_out)
+
+    if is_downloadable(session, url, timeout=timeout):
+        r = session.get(url, stream=True, allow_redirects=True, timeout=timeout)
+    else:
+        r = session.post(
+            url,
+            stream=True,
+            allow_redirects=True,
+            data=activations.COPERNICUS_EMS_WEBSCRAPE_DATA,
+            timeout=timeout,
+        )
+
+    tmp_path = file_path_out + ".part"
+    try:
+        with r:
+            r.raise_for_status()
+            with open(tmp_path, "wb") as f:
+                for chunk in r.iter_content(chunk_size=1024 * 1024):
+                    f.write(chunk)
+        if not zipfile.is_zipfile(tmp_path):
+            raise ValueError(f"{url} did not return a zip file")
+        os.replace(tmp_path, file_path_out)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return file_path_out
+
+
+def download_activations(
+    emsr_codes,
+    folder_out,
+    journal_path,
+    max_workers=8,
+    max_per_host=4,
+    retries=3,
+    backoff=1.0,
+    session=None,
+    extract=True,
+    refresh_codes=(),
+):
+    """
+    Download and unzip the vector products of EMS activations concurrently.
+
+    Zip file URLs are listed and zip files are downloaded by a bounded pool of
+    threads sharing one pooled HTTP session, with at most max_per_host requests
+    in flight per host. Failed requests are retried with exponential backoff.
+    Completed steps are written to a journal so a rerun resumes where a crashed
+    run stopped.
+
+    Args:
+        emsr_codes (list): EMSR codes to download.
+        folder_out (str): Folder to save and unzip the zip files in.
+        journal_path (str): Path to the journal file.
+        max_workers (int): Number of worker threads.
+        max_per_host (int): Maximum number of concurrent requests per host.
+        retries (int): Number of retries for each request.
+        backoff (float): Base delay in seconds between retries.
+        session (requests.Session): Session to download with. A pooled session
+            is created with http_cache.make_session if not given.
+        extract (bool): Extract the zip files. If False the zip files are kept
+            as downloaded and read in place through GDAL's /vsizip/.
+        refresh_codes (list): EMSR codes whose zip file URLs are listed again
+            instead of read from the journal, e.g. activations that changed
+            since the last run.
+
+    Returns:
+        tuple: (unzip_files_by_code, failed_codes) where unzip_files_by_code
+        maps each EMSR code to its unzipped FEP, DEL and GRA product folders
+        (or zip files if extract is False), in the order the zip files are
+        listed for the activation, and failed_codes is the set of EMSR codes
+        whose zip files could not be listed or downloaded.
+    """
+    journal = DownloadJournal(journal_path)
+    close_session = session is None
+    if session is None:
+        session = http_cache.make_session(pool_maxsize=max_workers)
+    host_limit = _HostLimiter(max_per_host)
+
+    def fetch_urls(code):
+        if code in journal.zip_urls and code not in refresh_codes:
+            return journal.zip_urls[code]
+        with host_limit(EMS_COMPONENTS_HOST):
+            urls = with_retries(
+                fetch_zip_file_urls, session, code, retries=retries, backoff=backoff
+            )
+        journal.record_urls(code, list(urls))
+        return urls
+
+    def fetch_zip(code, zip_file):
+        unzipped = journal.unzipped.get(zip_file)
+        if unzipped and os.path.exists(unzipped):
+            # Zip files recorded by an earlier run may be invalid, e.g. a
+            # saved HTML page, and are downloaded again
+            if os.path.isdir(unzipped) or zipfile.is_zipfile(unzipped):
+                return unzipped
+
+        with host_limit(zip_file):
+            local_zip_file = with_retries(
+                download_file, session, zip_file, folder_out, retries=retries, backoff=backoff
+            )
+
+        if not extract:
+            journal.record_unzipped(code, zip_file, local_zip_file)
+            return local_zip_file
+
+        # Remove a partially extracted folder left by a crashed run
+        # before unzipping again.
+        unzip_dir = os.path.join(
+            folder_out, os.path.splitext(os.path.basename(local_zip_file))[0]
+        )
+        if os.path.isdir(unzip_dir):
+            shutil.rmtree(unzip_dir)
+
+        unzipped_file = activations.unzip_copernicus_ems(
+            local_zip_file, folder_out=folder_out
+        )
+        journal.record_unzipped(code, zip_file, unzipped_file)
+        return unzipped_file
+
+    unzip_files_by_code = {code: [] for code in emsr_codes}
+    failed_codes = set()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        # List the zip files of every activation
+        url_futures = {code: pool.submit(fetch_urls, code) for code in emsr_codes}
+        zip_futures = []
+        for code, future in url_futures.items():
+            try:
+                zip_files = future.result()
+            except Exception:
+                logger.exception(f"Could not list zip files for EMSR code {code}")
+                failed_codes.add(code)
+                continue
+            for zip_file in zip_files:
+                zip_futures.append((code, zip_file, pool.submit(fetch_zip, code, zip_file)))
+
+        # Collect the unzipped folders in the order the zip files are listed
+        for code, zip_file, future in zip_futures:
+            try:
+                unzipped_file = future.result()
+            except Exception:
+                logger.exception(f"{zip_file} caused an Exception")
+                failed_codes.add(code)
+                continue
+            if is_vector_product(zip_file):
+                unzip_files_by_code[code].append(unzipped_file)
+
+    if close_session:
+        session.close()
+
+    return unzip_files_by_code, failed_codes
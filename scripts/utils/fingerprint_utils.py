@@ -0,0 +1,124 @@
+import os
+import hashlib
+import pandas as pd
+
+from shapely import wkb
+from shapely.ops import transform
+from utils.static_image_utils import JRC_LAST_YEAR
+
+# Decimal places kept when normalising AOI coordinates (about 1 cm)
+COORDINATE_PRECISION = 7
+
+# Columns of the table mapping products to shared static images
+FINGERPRINT_COLUMNS = ["static_image", "fingerprint", "shared_static_image"]
+
+
+def aoi_fingerprint(aoi_polygon, year):
+    """
+    Hash the normalised AOI polygon and the JRC year used for its static image.
+
+    Products of the same EMSR code and AOI (e.g. DEL, GRA and MONIT products)
+    share one footprint, so their static images are identical and get the
+    same fingerprint.
+
+    Args:
+        aoi_polygon: Shapely polygon of the AOI.
+        year (int): Year of the event.
+
+    Returns:
+        str: Hex digest identifying the static image.
+    """
+    geometry = transform(
+        lambda x, y, z=None: (
+            round(x, COORDINATE_PRECISION),
+            round(y, COORDINATE_PRECISION),
+        ),
+        aoi_polygon,
+    )
+    geometry = geometry.normalize()
+    jrc_year = min(int(year), JRC_LAST_YEAR)
+
+    digest = hashlib.sha1(wkb.dumps(geometry))
+    digest.update(str(jrc_year).encode())
+
+    return digest.hexdigest()
+
+
+class SharedStaticImages:
+    """
+    Assign each product's static image to the first static image with the
+    same AOI fingerprint, so each unique footprint is exported once.
+
+    The mapping saved by to_csv only points products to static images that
+    are available (e.g. whose export completed), so a failed export never
+    leaves other products linked to a missing image. Static images whose
+    export failed in a previous run are not assigned to other products, so
+    another product with the same fingerprint is exported instead.
+
+    Args:
+        failed (set): Names of the static images whose export failed.
+    """
+
+    def __init__(self, failed=()):
+        self.failed = set(failed)
+        self.candidates = {}
+        self.records = []
+
+    def assign(self, static_image, aoi_polygon, year):
+        """
+        Args:
+            static_image (str): Static image name of the product, e.g.
+                EMSR264_01AMBILOPE_DEL_v2_static_images.
+            aoi_polygon: Shapely polygon of the AOI.
+            year (int): Year of the event.
+
+        Returns:
+            str: Name of the static image to export for the footprint. It
+            equals static_image when the product is the first with its
+            fingerprint whose export did not fail.
+        """
+        fingerprint = aoi_fingerprint(aoi_polygon, year)
+        candidates = self.candidates.setdefault(fingerprint, [])
+        candidates.append(static_image)
+        self.records.append((static_image, fingerprint))
+        return next((c for c in candidates if c not in self.failed), candidates[0])
+
+    def to_csv(self, path, available):
+        """
+        Save the mapping of products to shared static images.
+
+        Each product is mapped to the first available static image with its
+        fingerprint, or to its own static image if none is available.
+
+        Args:
+            path (str): Path to save the CSV file.
+            available (set): Names of the static images that were exported.
+        """
+        owners = {
+            fingerprint: next((c for c in candidates if c in available), None)
+            for fingerprint, candidates in self.candidates.items()
+        }
+        records = [
+            (static_image, fingerprint, owners[fingerprint] or static_image)
+            for static_image, fingerprint in self.records
+        ]
+        pd.DataFrame(records, columns=FINGERPRINT_COLUMNS).to_csv(path, index=False)
+
+
+def read_shared_static_images(path):
+    """
+    Read the mapping of static images to the shared static images exported
+    for their AOI fingerprint.
+
+    Args:
+        path (str): Path to the CSV file written by SharedStaticImages.to_csv.
+
+    Returns:
+        dict: Static image name to shared static image name, only for static
+        images that were not exported themselves.
+    """
+    if not os.path.exists(path):
+        return {}
+    mapping = pd.read_csv(path)
+    mapping = mapping[mapping["static_image"] != mapping["shared_static_image"]]
+    return dict(zip(mapping["static_image"], mapping["shared_static_image"]))
@@ -0,0 +1,180 @@
+import os
+import json
+import pandas as pd
+import geopandas as gpd
+import pyarrow.parquet as pq
+
+from utils import product_index as index_helpers
+from utils.utils import atomic_write
+
+# All floodmaps are stored in the same CRS so products partitioned
+# under the same dataset share one GeoParquet schema.
+STORE_CRS = "EPSG:4326"
+
+# Columns of the floodmap GeoDataFrame generated by ml4floods
+FLOODMAP_COLUMNS = ["geometry", "w_class", "source"]
+
+# Types of the metadata table columns. Columns are cast so every
+# product file has the same schema, even when values are missing.
+METADATA_DTYPES = {
+    "name": "string",
+    "event_id": "string",
+    "aoi_code": "string",
+    "product": "string",
+    "monit": "string",
+    "version": "Int64",
+    "satellite_date": "datetime64[ns]",
+    "date_ems_code": "datetime64[ns]",
+    "country": "string",
+    "event_type": "string",
+    "metadata_json": "string",
+}
+
+
+def _partition_path(store_dir, table, ems_code):
+    return os.path.join(store_dir, table, f"ems_code={ems_code}")
+
+
+def _product_filters(name=None, ems_code=None):
+    filters = []
+    if name is not None:
+        ems_code = ems_code or index_helpers.parse_product_name(name).code
+        filters.append(("name", "=", name))
+    if ems_code is not None:
+        filters.append(("ems_code", "=", ems_code))
+    return filters or None
+
+
+def _as_str(value):
+    return None if value is None else str(value)
+
+
+def metadata_record(name, metadata_floodmap):
+    """
+    Convert an ml4floods metadata dictionary into a typed metadata record.
+
+    Args:
+        name (str): Name of the vector product.
+        metadata_floodmap (dict): Metadata from activations.filter_register_copernicusems.
+
+    Returns:
+        dict: Typed metadata record. The full metadata is kept as JSON in
+        the metadata_json field.
+    """
+    product = index_helpers.parse_product_name(name)
+    metadata_json = {
+        k: v for k, v in metadata_floodmap.items() if k != "area_of_interest_polygon"
+    }
+
+    return {
+        "name": name,
+        "event_id": metadata_floodmap.get("event id"),
+        "aoi_code": product.aoi,
+        "product": product.product,
+        "monit": product.monit,
+        "version": product.version,
+        "satellite_date": metadata_floodmap.get("satellite date"),
+        "date_ems_code": metadata_floodmap.get("date_ems_code"),
+        "country": _as_str(metadata_floodmap.get("country")),
+        "event_type": _as_str(metadata_floodmap.get("event type")),
+        "metadata_json": json.dumps(metadata_json, default=str),
+        "geometry": metadata_floodmap["area_of_interest_polygon"],
+    }
+
+
+def write_floodmap(store_dir, name, floodmap, metadata_floodmap):
+    """
+    Write a floodmap and its metadata to the GeoParquet store.
+
+    Floodmaps are written to <store_dir>/floodmaps and metadata to
+    <store_dir>/metadata, both partitioned by EMSR code with one file
+    per product.
+
+    Args:
+        store_dir (str): Folder of the store.
+        name (str): Name of the vector product.
+        floodmap (gpd.GeoDataFrame): Floodmap from activations.generate_floodmap.
+        metadata_floodmap (dict): Metadata from activations.filter_register_copernicusems.
+
+    Returns:
+        str: Path to the floodmap file.
+    """
+    ems_code = index_helpers.parse_product_name(name).code
+
+    floodmap = floodmap[FLOODMAP_COLUMNS].to_crs(STORE_CRS)
+    floodmap["name"] = name
+    floodmap_dir = _partition_path(store_dir, "floodmaps", ems_code)
+    os.makedirs(floodmap_dir, exist_ok=True)
+    floodmap_path = os.path.join(floodmap_dir, name + ".parquet")
+    with atomic_write(floodmap_path) as tmp_path:
+        floodmap.to_parquet(tmp_path, index=False)
+
+    metadata = gpd.GeoDataFrame(
+        [metadata_record(name, metadata_floodmap)], geometry="geometry", crs=STORE_CRS
+    )
+    for column, dtype in METADATA_DTYPES.items():
+        if dtype.startswith("datetime"):
+            metadata[column] = pd.to_datetime(metadata[column])
+        else:
+            metadata[column] = metadata[column].astype(dtype)
+    metadata_dir = _partition_path(store_dir, "metadata", ems_code)
+    os.makedirs(metadata_dir, exist_ok=True)
+    with atomic_write(os.path.join(metadata_dir, name + ".parquet")) as tmp_path:
+        metadata.to_parquet(tmp_path, index=False)
+
+    return floodmap_path
+
+
+def read_floodmap(store_dir, name=None, ems_code=None, columns=None, filters=None):
+    """
+    Read floodmaps from the GeoParquet store. Filters on the product name and
+    EMSR code are pushed down to the partitions and row groups of the store.
+
+    Args:
+        store_dir (str): Folder of the store.
+        name (str): Only read the floodmap of this product.
+        ems_code (str): Only read floodmaps of this EMSR code.
+        columns (list): Columns to read. Defaults to FLOODMAP_COLUMNS.
+        filters (list): Additional pyarrow filters, e.g. [("source", "!=", "hydro_l")].
+
+    Returns:
+        gpd.GeoDataFrame: Floodmap polygons with their w_class and source.
+    """
+    columns = columns or FLOODMAP_COLUMNS
+    filters = (_product_filters(name, ems_code) or []) + (filters or [])
+
+    return gpd.read_parquet(
+        os.path.join(store_dir, "floodmaps"), columns=columns, filters=filters or None
+    )
+
+
+def read_metadata(store_dir, ems_code=None, columns=None):
+    """
+    Read the typed metadata table of the GeoParquet store.
+
+    Args:
+        store_dir (str): Folder of the store.
+        ems_code (str): Only read metadata of this EMSR code.
+        columns (list): Columns to read. The AOI polygons are read as a
+            GeoDataFrame if geometry is in columns.
+
+    Returns:
+        pd.DataFrame: One row per product.
+    """
+    path = os.path.join(store_dir, "metadata")
+    filters = _product_filters(ems_code=ems_code)
+
+    if columns is None or "geometry" in columns:
+        return gpd.read_parquet(path, columns=columns, filters=filters)
+
+    return pq.read_table(path, columns=columns, filters=filters).to_pandas()
+
+
+def list_products(store_dir, ems_code=None):
+    """
+    List the names of the products in the GeoParquet store.
+    """
+    if not os.path.isdir(os.path.join(store_dir, "metadata")):
+        return []
+    metadata = read_metadata(store_dir, ems_code=ems_code, columns=["name"])
+    return sorted(metadata["name"].tolist())
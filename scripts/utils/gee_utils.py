@@ -1,6 +1,7 @@
 import ee
 import os
 import pandas as pd
+import geopandas as gpd
 
 ee.Initialize()
 
@@ -31,6 +32,28 @@ def get_tropical_countries(country_list):
     return (list(in_tropics))
 
 
+def download_country_boundaries(path, simplify_m=1000):
+    """
+    Download country boundaries from Earth Engine's country vector layer
+    and cache them as a GeoParquet file, so that tropical countries can be
+    filtered offline with country_utils.get_tropical_countries.
+
+    Args:
+        path (str): Path to save the GeoParquet file.
+        simplify_m (float): Error margin in meters used to simplify the
+            boundaries and keep the download small.
+    """
+    countries = ee.FeatureCollection('FAO/GAUL/2015/level0') \
+        .select(['ADM0_NAME']) \
+        .map(lambda f: f.simplify(simplify_m))
+
+    features = countries.getInfo()["features"]
+    boundaries = gpd.GeoDataFrame.from_features(features, crs="EPSG:4326")
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    boundaries.to_parquet(path)
+
+
 def get_static_images(year, bounds):
     """
     Get Google Earth Engine Image assets for water and land cover intersecting EMS flood extent.
@@ -0,0 +1,238 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import threading
+import requests
+
+from urllib.parse import quote, unquote, urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Transport mode, one of:
+#   live: send requests to the network (default)
+#   record: send requests to the network and save responses to the store
+#   replay: serve responses from the store through a local HTTP server
+HTTP_CACHE_MODE = os.environ.get("HTTP_CACHE_MODE", "live")
+
+# Folder of the content-addressed response store
+HTTP_CACHE_DIR = os.environ.get(
+    "HTTP_CACHE_DIR", os.path.join(os.getcwd(), "source-data", "http-cache")
+)
+
+
+class ContentStore:
+    """
+    Content-addressed store of HTTP responses.
+
+    Response bodies are saved once under objects/ by their SHA-256 hash. An
+    append-only index.jsonl maps each request (method and URL) to the hash,
+    status code, content type and redirect location of its response; the
+    last entry for a request wins.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.index_path = os.path.join(root, "index.jsonl")
+        self.index = {}
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.index[self.key(record["method"], record["url"])] = record
+
+    @staticmethod
+    def key(method, url):
+        return f"{method.upper()} {url}"
+
+    def object_path(self, sha256):
+        return os.path.join(self.root, "objects", sha256[:2], sha256)
+
+    def lookup(self, method, url):
+        return self.index.get(self.key(method, url))
+
+    def put(self, method, url, status, content_type, body, location=None):
+        """
+        Save a response body and index it against its request.
+        """
+        sha256 = hashlib.sha256(body).hexdigest()
+        path = self.object_path(sha256)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.part"
+            with open(tmp_path, "wb") as f:
+                f.write(body)
+            os.replace(tmp_path, path)
+
+        record = {
+            "method": method.upper(),
+            "url": url,
+            "status": status,
+            "content_type": content_type,
+            "location": location,
+            "sha256": sha256,
+        }
+        with self._lock:
+            self.index[self.key(method, url)] = record
+            with open(self.index_path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+
+        return sha256
+
+
+class RecordingAdapter(HTTPAdapter):
+    """
+    Transport adapter that saves every response to a ContentStore.
+
+    Redirects are followed by the session one hop at a time, so each hop is
+    saved with its Location header and replayed as a redirect.
+    """
+
+    def __init__(self, store, **kwargs):
+        self.store = store
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        # Reading content consumes streamed bodies, which are then
+        # served from memory to the caller.
+        self.store.put(
+            request.method,
+            request.url,
+            response.status_code,
+            response.headers.get("Content-Type"),
+            response.content,
+            location=response.headers.get("Location"),
+        )
+        return response
+
+
+class _ReplayHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        url = unquote(query.get("url", [""])[0])
+        method = query.get("method", ["GET"])[0]
+        record = self.server.store.lookup(method, url)
+        if record is None:
+            self.send_error(404, f"No recorded response for {method} {url}")
+            return
+
+        path = self.server.store.object_path(record["sha256"])
+        self.send_response(record["status"])
+        if record["content_type"]:
+            self.send_header("Content-Type", record["content_type"])
+        if record.get("location"):
+            self.send_header("Location", record["location"])
+        self.send_header("Content-Length", str(os.path.getsize(path)))
+        self.end_headers()
+        with open(path, "rb") as f:
+            shutil.copyfileobj(f, self.wfile)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class ReplayServer:
+    """
+    Local stand-in HTTP server that serves recorded responses from a ContentStore.
+    """
+
+    def __init__(self, store, host="127.0.0.1", port=0):
+        self.httpd = ThreadingHTTPServer((host, port), _ReplayHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.store = store
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def replay_url(self, method, url):
+        return f"{self.url}?method={method.upper()}&url={quote(url, safe='')}"
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class ReplayAdapter(HTTPAdapter):
+    """
+    Transport adapter that sends requests to a ReplayServer instead of the network.
+    """
+
+    def __init__(self, server, **kwargs):
+        self.server = server
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        url = request.url
+        replay_request = request.copy()
+        replay_request.url = self.server.replay_url(request.method, url)
+        response = super().send(replay_request, **kwargs)
+        response.url = url
+        response.request = request
+        return response
+
+
+_replay_servers = {}
+_replay_servers_lock = threading.Lock()
+
+
+def get_replay_server(store_dir=None):
+    """
+    Get the ReplayServer for a store, starting it on first use.
+    """
+    store_dir = store_dir or HTTP_CACHE_DIR
+    with _replay_servers_lock:
+        if store_dir not in _replay_servers:
+            _replay_servers[store_dir] = ReplayServer(ContentStore(store_dir))
+            logger.info(
+                f"Replaying HTTP responses from {store_dir} at {_replay_servers[store_dir].url}"
+            )
+        return _replay_servers[store_dir]
+
+
+def make_session(pool_maxsize=8, mode=None, store_dir=None):
+    """
+    Create a requests session with a pooled transport for the given cache mode.
+
+    Args:
+        pool_maxsize (int): Maximum number of pooled connections per host.
+        mode (str): One of "live", "record" or "replay". Defaults to the
+            HTTP_CACHE_MODE environment variable.
+        store_dir (str): Folder of the response store. Defaults to the
+            HTTP_CACHE_DIR environment variable.
+
+    Returns:
+        requests.Session: Session to reuse across requests.
+    """
+    mode = mode or HTTP_CACHE_MODE
+    store_dir = store_dir or HTTP_CACHE_DIR
+    pool_kwargs = {"pool_connections": pool_maxsize, "pool_maxsize": pool_maxsize}
+
+    if mode == "live":
+        adapter = HTTPAdapter(**pool_kwargs)
+    elif mode == "record":
+        adapter = RecordingAdapter(ContentStore(store_dir), **pool_kwargs)
+    elif mode == "replay":
+        adapter = ReplayAdapter(get_replay_server(store_dir), **pool_kwargs)
+    else:
+        raise ValueError(f"Unknown HTTP cache mode {mode}")
+
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    return session
+
@@ -0,0 +1,232 @@
+import os
+import re
+
+from collections import defaultdict
+from typing import NamedTuple, Optional
+
+# Suffixes added to EMS product names by the pipeline stages
+NAME_SUFFIXES = (
+    "_static_images_ground_truth_merged",
+    "_ground_truth_merged",
+    "_static_images_ground_truth",
+    "_static_images",
+    "_vector",
+)
+
+# Product types written in full in the vector product names and
+# abbreviated in the EMS event ids (e.g. 01DELINEATION_MAP and DEL)
+PRODUCT_TYPES = {
+    "DEL": "DEL",
+    "DELINEATION": "DEL",
+    "GRA": "GRA",
+    "GRADING": "GRA",
+    "FEP": "FEP",
+    "FIRSTESTIMATE": "FEP",
+}
+
+# AOI names abbreviated in the EMS event ids
+AOI_ALIASES = {
+    "03MURAMBINDASW": "03MURAMBINDASOUTHWEST",
+    "04MURAMBINDASE": "04MURAMBINDASOUTHEAST",
+    "06RUSITUVALLEYSW": "06RUSITUVALLEYSOUTHWEST",
+    "07RUSITUVALLEYSE": "07RUSITUVALLEYSOUTHEAST",
+}
+
+# Tokens marking the end of the product type in a product name
+_END_OF_PRODUCT = re.compile(r"^(MONIT\d+|PRODUCT|VECTORS|r\d+|v\d+)$")
+
+
+class ProductName(NamedTuple):
+    """
+    Identity of an EMS product parsed from a file name.
+
+    name is the file name, stem the name without extension and pipeline
+    suffixes, aoi and product the raw tokens of the name and version the
+    product version number if present.
+    """
+
+    name: str
+    stem: str
+    code: str
+    aoi: str
+    product: str
+    monit: Optional[str]
+    version: Optional[int]
+
+    @property
+    def event_aoi(self):
+        """
+        EMSR code and AOI as written in the name, e.g. EMSR264_01AMBILOPE.
+        """
+        return f"{self.code}_{self.aoi}"
+
+    @property
+    def key(self):
+        """
+        Canonical (code, AOI, product type, MONIT) key that matches a vector
+        product with the static images exported for its event id.
+        """
+        aoi = AOI_ALIASES.get(self.aoi, self.aoi)
+        product = re.sub(r"^\d+", "", self.product)
+        if product.endswith("_MAP"):
+            product = product[: -len("_MAP")]
+        product = PRODUCT_TYPES.get(product, product)
+        return (self.code, aoi, product, self.monit)
+
+
+def parse_product_name(name):
+    """
+    Parse the EMSR code, AOI, product type, MONIT number and version from
+    the name of an EMS product or of a file derived from it.
+
+    Args:
+        name (str): File name or path, e.g.
+            EMSR264_01AMBILOPE_01DELINEATION_MAP_v2_vector or
+            EMSR517_AOI01_DEL_MONIT01_v1_static_images-0000000000-0000000000.tif
+
+    Returns:
+        ProductName: Parsed name, or None if the name is not an EMS product name.
+    """
+    name = os.path.basename(name.rstrip("/"))
+    stem = name.split(".")[0]
+    for suffix in NAME_SUFFIXES:
+        if suffix in stem:
+            stem = stem[: stem.index(suffix)]
+            break
+
+    tokens = stem.split("_")
+    if len(tokens) < 2 or not tokens[0].startswith("EMSR"):
+        return None
+
+    product_tokens = []
+    monit = None
+    version = None
+    for t in tokens[2:]:
+        if _END_OF_PRODUCT.match(t):
+            if t.startswith("MONIT"):
+                monit = t
+            elif re.match(r"^v\d+$", t):
+                version = int(t[1:])
+        elif monit is None and version is None:
+            product_tokens.append(t)
+
+    return ProductName(
+        name=name,
+        stem=stem,
+        code=tokens[0],
+        aoi=tokens[1],
+        product="_".join(product_tokens),
+        monit=monit,
+        version=version,
+    )
+
+
+def fixed_static_image_name(name):
+    """
+    Rename a static image exported under an EMS event id to follow the
+    naming of its vector product, e.g. EMSR264_01AMBILOPE_DEL_v2 to
+    EMSR264_01AMBILOPE_01DELINEATION_MAP_v2 and 03MURAMBINDASW to
+    03MURAMBINDASOUTHWEST.
+
+    Args:
+        name (str): File name of the static image.
+
+    Returns:
+        str: File name following the vector product naming.
+    """
+    parts = name.split("_")
+
+    # Fix the naming of mapping products
+    if not parts[1].startswith("AOI"):
+        if parts[2].startswith("DEL") and parts[3].startswith("v"):
+            parts[2] = parts[2].replace("DEL", "01DELINEATION_MAP")
+        elif parts[2] == "DEL" and parts[3].startswith("MONIT"):
+            parts[2] = parts[2].replace("DEL", "01DELINEATION")
+        elif parts[2].startswith("GRA") and parts[3].startswith("v"):
+            parts[2] = parts[2].replace("GRA", "02GRADING_MAP")
+        elif parts[2].startswith("GRA") and parts[3].startswith("MONIT"):
+            parts[2] = parts[2].replace("GRA", "02GRADING")
+
+    # Fix the naming of AOI
+    parts[1] = AOI_ALIASES.get(parts[1], parts[1])
+
+    return "_".join(parts)
+
+
+class ProductIndex:
+    """
+    Index of EMS product files built once from a list of names, with dict
+    lookups by name, stem, canonical key and EMSR code/AOI.
+    """
+
+    def __init__(self, names):
+        self.products = []
+        self.by_name = {}
+        self.by_stem = defaultdict(list)
+        self.by_key = defaultdict(list)
+        self.by_event_aoi = defaultdict(list)
+
+        for name in sorted(names):
+            product = parse_product_name(name)
+            if product is None:
+                continue
+            self.products.append(product)
+            self.by_name[product.name] = product
+            self.by_stem[product.stem].append(product)
+            self.by_key[product.key].append(product)
+            self.by_event_aoi[product.event_aoi].append(product)
+
+    @classmethod
+    def from_dir(cls, path, suffix=None):
+        """
+        Build an index of the files in a directory.
+
+        Args:
+            path (str): Directory to list.
+            suffix (str): Only index file names ending with suffix.
+
+        Returns:
+            ProductIndex: Index of the files.
+        """
+        names = os.listdir(path)
+        if suffix is not None:
+            names = [n for n in names if n.endswith(suffix)]
+        return cls(names)
+
+    def __len__(self):
+        return len(self.products)
+
+    def __iter__(self):
+        return iter(self.products)
+
+    def matching(self, product):
+        """
+        Get the indexed products with the same canonical key as product.
+        """
+        return self.by_key.get(product.key, [])
+
+
+def latest_versions(paths):
+    """
+    Keep only the latest version of each product, i.e. the one with the
+    largest v* number, because the latest version is the highest quality
+    product.
+
+    Args:
+        paths (list): Paths of unzipped vector products.
+
+    Returns:
+        list: Paths of the latest version of each product, in input order.
+    """
+    latest = {}
+    for path in paths:
+        product = parse_product_name(path)
+        if product is None:
+            latest[path] = (None, path)
+            continue
+        version = product.version or 0
+        if product.key not in latest or version > latest[product.key][0]:
+            latest[product.key] = (version, path)
+
+    keep = set(p for _, p in latest.values())
+    return [p for p in paths if p in keep]
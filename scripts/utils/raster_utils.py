@@ -0,0 +1,307 @@
+import os
+import numpy as np
+import rasterio
+import rasterio.shutil
+
+from affine import Affine
+from contextlib import contextmanager
+from osgeo import gdal
+from rasterio.windows import Window
+from utils.utils import atomic_write
+
+# Size of the output windows merged at once
+BLOCK_SIZE = 1024
+
+# Creation options of the intermediate GeoTIFF written before the COG.
+# It is tiled so windowed writes are cheap, and compressed with the
+# fastest ZSTD level, which costs little CPU but writes and reads back
+# far fewer bytes than an uncompressed file. It is removed once the COG
+# is written. Rasters already on disk are copied with copy_to_cog
+# without staging.
+STAGING_CREATION_OPTIONS = {
+    "driver": "GTiff",
+    "tiled": True,
+    "blockxsize": 512,
+    "blockysize": 512,
+    "compress": "ZSTD",
+    "zstd_level": 1,
+    "BIGTIFF": "IF_NEEDED",
+}
+
+# Creation options of the GDAL COG driver for all raster outputs. Integer
+# masks and static images compress best with the horizontal predictor.
+# The number of compression threads is set per call with num_threads.
+COG_CREATION_OPTIONS = {
+    "BLOCKSIZE": 512,
+    "PREDICTOR": "YES",
+    "BIGTIFF": "IF_SAFER",
+}
+
+
+def pool_num_threads(workers):
+    """
+    Get the number of COG compression threads of each process of a pool,
+    so the pool uses about one thread per CPU in total.
+
+    Args:
+        workers (int): Number of processes writing COGs at once.
+
+    Returns:
+        int or str: "ALL_CPUS" for a single process, otherwise the number
+        of CPUs divided among the processes, at least 1.
+    """
+    if workers <= 1:
+        return "ALL_CPUS"
+    return max(1, (os.cpu_count() or 1) // workers)
+
+
+@contextmanager
+def cog_writer(
+    out_path, profile, compress="DEFLATE", overview_resampling="NEAREST", num_threads="ALL_CPUS"
+):
+    """
+    Open a raster for writing and save it as a Cloud-Optimized GeoTIFF.
+
+    The raster is written (e.g. window by window) to a tiled staging
+    GeoTIFF next to out_path, then copied to out_path with the COG driver,
+    which compresses with num_threads threads and builds internal overviews.
+    The COG is written atomically and the staging file is removed.
+
+    Args:
+        out_path (str): Path to save the COG.
+        profile (dict): Profile of the raster, e.g. src.meta of an input.
+            Its driver and creation options are replaced.
+        compress (str): "DEFLATE" or "ZSTD".
+        overview_resampling (str): Resampling of the overviews, "NEAREST"
+            or "MODE" for class masks.
+        num_threads (int or str): Number of compression threads, or
+            "ALL_CPUS". Use pool_num_threads in a pool of processes.
+
+    Yields:
+        rasterio.io.DatasetWriter: Dataset to write the raster to.
+    """
+    profile = {
+        k: v
+        for k, v in profile.items()
+        if k in ("dtype", "count", "width", "height", "crs", "transform", "nodata")
+    }
+    profile.update(STAGING_CREATION_OPTIONS)
+
+    folder, name = os.path.split(out_path)
+    staging_path = os.path.join(folder, f".{name}.{os.getpid()}.staging.tif")
+    try:
+        with rasterio.open(staging_path, "w", **profile) as dst:
+            yield dst
+
+        with atomic_write(out_path) as tmp_path:
+            rasterio.shutil.copy(
+                staging_path,
+                tmp_path,
+                driver="COG",
+                COMPRESS=compress,
+                OVERVIEW_RESAMPLING=overview_resampling,
+                NUM_THREADS=num_threads,
+                **COG_CREATION_OPTIONS,
+            )
+    finally:
+        if os.path.exists(staging_path):
+            os.remove(staging_path)
+
+
+def union_grid(sources):
+    """
+    Get the grid covering the union of aligned rasters and the position of
+    each raster on it. The grid has the resolution of the first raster.
+
+    Args:
+        sources (list): Open rasterio datasets with the same CRS, pixel size
+            and grid alignment, e.g. images split in the GEE export or masks
+            of the same AOI.
+
+    Returns:
+        tuple: (transform, width, height, placements) where placements is
+        the Window of each raster on the grid.
+    """
+    first = sources[0]
+    for src in sources[1:]:
+        if src.crs != first.crs:
+            raise ValueError(f"Cannot align {src.name} with {first.name}: CRS differ")
+        if not np.allclose(src.res, first.res):
+            raise ValueError(f"Cannot align {src.name} with {first.name}: pixel sizes differ")
+
+    res_x, res_y = first.res
+    left = min(src.bounds.left for src in sources)
+    top = max(src.bounds.top for src in sources)
+    right = max(src.bounds.right for src in sources)
+    bottom = min(src.bounds.bottom for src in sources)
+    transform = Affine(res_x, 0, left, 0, -res_y, top)
+    width = int(round((right - left) / res_x))
+    height = int(round((top - bottom) / res_y))
+
+    placements = []
+    for src in sources:
+        col, row = ~transform * (src.transform.c, src.transform.f)
+        placements.append(Window(int(round(col)), int(round(row)), src.width, src.height))
+
+    return transform, width, height, placements
+
+
+def block_windows(src, window_size=1024):
+    """
+    Split a raster into windows aligned to its block grid, grouping blocks
+    into windows of about window_size pixels per side.
+    """
+    block_height, block_width = src.block_shapes[0]
+    window_height = block_height * max(1, window_size // block_height)
+    window_width = block_width * max(1, window_size // block_width)
+    for row_off in range(0, src.height, window_height):
+        for col_off in range(0, src.width, window_width):
+            yield Window(
+                col_off,
+                row_off,
+                min(window_width, src.width - col_off),
+                min(window_height, src.height - row_off),
+            )
+
+
+def copy_to_cog(
+    src_path, out_path, compress="DEFLATE", overview_resampling="NEAREST", num_threads="ALL_CPUS"
+):
+    """
+    Copy a raster to a Cloud-Optimized GeoTIFF, e.g. a static image that
+    was not split in the GEE export.
+
+    Args:
+        src_path (str): Path to the raster.
+        out_path (str): Path to save the COG.
+        compress (str): "DEFLATE" or "ZSTD".
+        overview_resampling (str): Resampling of the overviews.
+        num_threads (int or str): Number of compression threads, or "ALL_CPUS".
+
+    Returns:
+        str: out_path
+    """
+    with atomic_write(out_path) as tmp_path:
+        rasterio.shutil.copy(
+            src_path,
+            tmp_path,
+            driver="COG",
+            COMPRESS=compress,
+            OVERVIEW_RESAMPLING=overview_resampling,
+            NUM_THREADS=num_threads,
+            **COG_CREATION_OPTIONS,
+        )
+
+    return out_path
+
+
+def merge_images(paths, out_path, block_size=BLOCK_SIZE, num_threads="ALL_CPUS"):
+    """
+    Merge images split in the GEE export into one image, window by window.
+
+    In-process counterpart of gdal_merge.py. The output covers the union of
+    the inputs on the grid of the first image and pixels are copied from
+    the inputs in order, so later images overwrite earlier ones where they
+    overlap. Only one output window and the matching input pixels are held
+    in memory at a time. The output is written as a COG with cog_writer.
+
+    Args:
+        paths (list): Paths to the images to merge. The images must share
+            the CRS, pixel size, number of bands and grid alignment.
+        out_path (str): Path to save the merged image.
+        block_size (int): Size of the output windows merged at once.
+        num_threads (int or str): Number of COG compression threads.
+
+    Returns:
+        str: out_path
+    """
+    sources = [rasterio.open(p) for p in paths]
+    try:
+        first = sources[0]
+        for src in sources[1:]:
+            if src.count != first.count:
+                raise ValueError(
+                    f"Cannot merge {src.name} with {first.name}: band counts differ"
+                )
+
+        # Grid of the output covering the union of the inputs and
+        # position of each input on the output grid
+        transform, width, height, placements = union_grid(sources)
+
+        profile = {
+            "dtype": first.dtypes[0],
+            "count": first.count,
+            "width": width,
+            "height": height,
+            "crs": first.crs,
+            "transform": transform,
+            "nodata": first.nodata,
+        }
+
+        with cog_writer(out_path, profile, num_threads=num_threads) as dst:
+            dst.descriptions = first.descriptions
+            for row_off in range(0, height, block_size):
+                for col_off in range(0, width, block_size):
+                    window = Window(
+                        col_off,
+                        row_off,
+                        min(block_size, width - col_off),
+                        min(block_size, height - row_off),
+                    )
+                    out = np.zeros(
+                        (first.count, window.height, window.width),
+                        dtype=profile["dtype"],
+                    )
+                    for src, placement in zip(sources, placements):
+                        r0 = max(window.row_off, placement.row_off)
+                        c0 = max(window.col_off, placement.col_off)
+                        r1 = min(window.row_off + window.height, placement.row_off + placement.height)
+                        c1 = min(window.col_off + window.width, placement.col_off + placement.width)
+                        if r0 >= r1 or c0 >= c1:
+                            continue
+                        data = src.read(
+                            window=Window(
+                                c0 - placement.col_off,
+                                r0 - placement.row_off,
+                                c1 - c0,
+                                r1 - r0,
+                            )
+                        )
+                        out[
+                            :,
+                            r0 - window.row_off : r1 - window.row_off,
+                            c0 - window.col_off : c1 - window.col_off,
+                        ] = data
+                    dst.write(out, window=window)
+    finally:
+        for src in sources:
+            src.close()
+
+    return out_path
+
+
+def build_vrt(paths, out_path):
+    """
+    Mosaic images split in the GEE export as a GDAL VRT referencing them.
+
+    Zero-copy counterpart of merge_images: no pixels are read or written,
+    and the VRT is read like a merged GeoTIFF by rasterio and GDAL. Later
+    images take precedence where they overlap, as in merge_images. The
+    images are referenced by absolute path, so they must stay in place.
+
+    Args:
+        paths (list): Paths to the images to mosaic.
+        out_path (str): Path to save the VRT.
+
+    Returns:
+        str: out_path
+    """
+    paths = [os.path.abspath(p) for p in paths]
+    with atomic_write(out_path) as tmp_path:
+        vrt = gdal.BuildVRT(tmp_path, paths)
+        if vrt is None:
+            raise RuntimeError(f"Failed to build VRT of {paths}: {gdal.GetLastErrorMsg()}")
+        # Flush the VRT to disk
+        vrt = None
+
+    return out_path
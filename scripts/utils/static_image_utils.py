@@ -0,0 +1,211 @@
+import os
+import numpy as np
+import geopandas as gpd
+import rasterio
+
+from affine import Affine
+from shapely.geometry import box
+from rasterio import features
+from rasterio.enums import Resampling
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import transform_bounds
+from rasterio.windows import Window
+from rasterio.windows import bounds as window_bounds
+from rasterio.windows import transform as window_transform
+from utils.utils import atomic_write
+
+# Permanent water (JRC YearlyHistory) is only available up to 2020
+JRC_LAST_YEAR = 2020
+
+# GEE exports with crs="EPSG:4326" and scale=10 use a pixel size of
+# 10 m at the equator in degrees, aligned to the origin of the CRS.
+PIXEL_SIZE = 10 / 111319.49079327357
+
+# Size of the output windows built at once
+BLOCK_SIZE = 1024
+
+# Bands of the static images, in order
+BANDS = ["water", "land_cover"]
+
+
+def build_tile_index(tiles_dir, index_path=None):
+    """
+    Build a footprint index of local WorldCover and JRC tiles from their headers.
+
+    Tiles are expected under tiles_dir/worldcover/ and
+    tiles_dir/jrc/<year>/, e.g. the ESA WorldCover 10m v100 COG tiles and
+    the JRC Global Surface Water YearlyClassification tiles.
+
+    Args:
+        tiles_dir (str): Folder of the tiles.
+        index_path (str): Path to cache the index as GeoParquet. The cached
+            index is reused if it exists.
+
+    Returns:
+        gpd.GeoDataFrame: One row per tile with its path, dataset, year and
+        footprint in EPSG:4326.
+    """
+    if index_path is not None and os.path.exists(index_path):
+        return gpd.read_parquet(index_path)
+
+    records = []
+    for root, _, files in os.walk(tiles_dir):
+        rel = os.path.relpath(root, tiles_dir).split(os.sep)
+        dataset = rel[0]
+        year = int(rel[1]) if dataset == "jrc" and len(rel) > 1 else None
+        for f in sorted(files):
+            if not f.endswith(".tif"):
+                continue
+            path = os.path.join(root, f)
+            with rasterio.open(path) as src:
+                bounds = transform_bounds(src.crs, "EPSG:4326", *src.bounds)
+            records.append(
+                {"path": path, "dataset": dataset, "year": year, "geometry": box(*bounds)}
+            )
+
+    tile_index = gpd.GeoDataFrame(records, geometry="geometry", crs="EPSG:4326")
+    if index_path is not None:
+        tile_index.to_parquet(index_path)
+
+    return tile_index
+
+
+def find_tiles(tile_index, geometry, dataset, year=None):
+    """
+    Find the tiles of a dataset intersecting a geometry.
+
+    Args:
+        tile_index (gpd.GeoDataFrame): Index from build_tile_index.
+        geometry: Shapely geometry in EPSG:4326.
+        dataset (str): "worldcover" or "jrc".
+        year (int): Year of the JRC tiles.
+
+    Returns:
+        list: Paths to the tiles.
+    """
+    candidates = tile_index.iloc[tile_index.sindex.query(geometry, predicate="intersects")]
+    candidates = candidates[candidates["dataset"] == dataset]
+    if year is not None:
+        candidates = candidates[candidates["year"] == year]
+    return sorted(candidates["path"].tolist())
+
+
+def aoi_grid(aoi_polygon):
+    """
+    Get the 10 m EPSG:4326 grid covering an AOI, aligned like GEE exports.
+
+    Returns:
+        tuple: (transform, width, height)
+    """
+    left, bottom, right, top = aoi_polygon.bounds
+    left = np.floor(left / PIXEL_SIZE) * PIXEL_SIZE
+    top = np.ceil(top / PIXEL_SIZE) * PIXEL_SIZE
+    width = int(np.ceil((right - left) / PIXEL_SIZE))
+    height = int(np.ceil((top - bottom) / PIXEL_SIZE))
+    transform = Affine(PIXEL_SIZE, 0, left, 0, -PIXEL_SIZE, top)
+    return transform, width, height
+
+
+def build_static_image(aoi_polygon, year, tile_index, out_path):
+    """
+    Build the static image of an AOI from local tiles. Local counterpart of
+    gee_utils.get_static_images and the GEE export in 01-download-images.py.
+
+    The image has two int32 bands, water (JRC YearlyHistory) and land_cover
+    (ESA WorldCover), on a 10 m EPSG:4326 grid, with pixels outside the AOI
+    set to 0. It is built one window at a time with windowed reads from
+    the intersecting tiles, so memory does not depend on the AOI size.
+
+    Args:
+        aoi_polygon: Shapely polygon of the AOI in EPSG:4326.
+        year (int): Year of the event.
+        tile_index (gpd.GeoDataFrame): Index from build_tile_index.
+        out_path (str): Path to save the static image.
+    """
+    year = min(year, JRC_LAST_YEAR)
+    tiles = {
+        "water": find_tiles(tile_index, aoi_polygon, "jrc", year),
+        "land_cover": find_tiles(tile_index, aoi_polygon, "worldcover"),
+    }
+
+    transform, width, height = aoi_grid(aoi_polygon)
+    profile = {
+        "driver": "GTiff",
+        "dtype": "int32",
+        "count": len(BANDS),
+        "width": width,
+        "height": height,
+        "crs": "EPSG:4326",
+        "transform": transform,
+        "nodata": None,
+        "tiled": True,
+        "blockxsize": 256,
+        "blockysize": 256,
+        "compress": "LZW",
+        "predictor": 2,
+        "BIGTIFF": "IF_SAFER",
+    }
+
+    # Open each tile warped onto the AOI grid. Reads from the warped
+    # tiles only fetch the source blocks under the requested window.
+    # Tiles are opened inside the try so those already open are closed if
+    # opening another one fails.
+    sources = {band: [] for band in BANDS}
+    vrts = {band: [] for band in BANDS}
+    try:
+        for band, paths in tiles.items():
+            for p in paths:
+                src = rasterio.open(p)
+                sources[band].append(src)
+                vrts[band].append(
+                    WarpedVRT(
+                        src,
+                        crs="EPSG:4326",
+                        transform=transform,
+                        width=width,
+                        height=height,
+                        resampling=Resampling.nearest,
+                    )
+                )
+
+        footprints = {
+            band: [box(*transform_bounds(src.crs, "EPSG:4326", *src.bounds)) for src in srcs]
+            for band, srcs in sources.items()
+        }
+
+        # Write to a temporary file so an interrupted run never leaves a
+        # partial image that later runs take as done
+        with atomic_write(out_path) as tmp_path, rasterio.open(tmp_path, "w", **profile) as dst:
+            dst.descriptions = tuple(BANDS)
+            for row_off in range(0, height, BLOCK_SIZE):
+                for col_off in range(0, width, BLOCK_SIZE):
+                    window = Window(
+                        col_off,
+                        row_off,
+                        min(BLOCK_SIZE, width - col_off),
+                        min(BLOCK_SIZE, height - row_off),
+                    )
+                    # Pixels with their centre in the AOI are valid, like GEE clip
+                    valid = features.geometry_mask(
+                        [aoi_polygon],
+                        out_shape=(window.height, window.width),
+                        transform=window_transform(window, transform),
+                        invert=True,
+                    )
+                    window_box = box(*window_bounds(window, transform))
+                    for b, band in enumerate(BANDS, start=1):
+                        out = np.zeros((window.height, window.width), dtype=np.int32)
+                        for vrt, footprint in zip(vrts[band], footprints[band]):
+                            if not footprint.intersects(window_box):
+                                continue
+                            data = vrt.read(1, window=window)
+                            # 0 is no data in both the JRC and WorldCover tiles
+                            np.copyto(out, data, where=data != 0, casting="unsafe")
+                        out[~valid] = 0
+                        dst.write(out, b, window=window)
+    finally:
+        for band in BANDS:
+            for vrt in vrts[band]:
+                vrt.close()
+            for src in sources[band]:
+                src.close()
@@ -0,0 +1,258 @@
+import os
+import json
+import time
+import logging
+import itertools
+
+from utils.utils import atomic_write, with_retries
+
+logger = logging.getLogger(__name__)
+
+# Earth Engine task states
+COMPLETED = "COMPLETED"
+FAILED = "FAILED"
+CANCELLED = "CANCELLED"
+PENDING = "PENDING"
+FINISHED_STATES = (COMPLETED, FAILED, CANCELLED)
+ACTIVE_STATES = ("READY", "RUNNING")
+
+
+class AttachedTask:
+    """
+    Task started by a previous run, polled by its id.
+
+    Args:
+        task_id (str): Id of the task.
+        task_status (callable): Function returning the status dict of a task
+            from its id, e.g. lambda task_id: ee.data.getTaskStatus(task_id)[0].
+    """
+
+    def __init__(self, task_id, task_status):
+        self.id = task_id
+        self.task_status = task_status
+
+    def status(self):
+        return self.task_status(self.id)
+
+
+class ExportScheduler:
+    """
+    Run Earth Engine export tasks with a bounded number of tasks in flight.
+
+    Tasks are submitted with a key and a function that creates the
+    (not yet started) ee.batch task. The scheduler starts tasks while fewer
+    than max_in_flight are running, polls their status, retries failed tasks
+    and saves the state of every task to a JSON file. Tasks whose state file
+    entry is COMPLETED are skipped, so a rerun only exports what is missing.
+    Tasks whose state file entry is READY or RUNNING, e.g. left running by a
+    crashed run, are polled by their task id instead of started again.
+    Errors getting the status of a task are retried, and the task is polled
+    again later if they persist.
+
+    Args:
+        state_path (str): Path to the JSON file of task states.
+        max_in_flight (int): Maximum number of tasks running at once.
+        poll_interval (float): Seconds between status polls.
+        max_retries (int): Number of times a failed task is restarted.
+        task_status (callable): Function returning the status dict of a task
+            from its id, used to poll tasks started by a previous run. They
+            are started again if it is not given.
+        status_retries (int): Number of retries of a failed status request.
+    """
+
+    def __init__(
+        self,
+        state_path,
+        max_in_flight=10,
+        poll_interval=30,
+        max_retries=2,
+        task_status=None,
+        status_retries=3,
+    ):
+        self.state_path = state_path
+        self.max_in_flight = max_in_flight
+        self.poll_interval = poll_interval
+        self.max_retries = max_retries
+        self.task_status = task_status
+        self.status_retries = status_retries
+        self.queue = []
+        self.running = {}
+        self.state = {}
+
+        if os.path.exists(state_path):
+            with open(state_path) as f:
+                self.state = json.load(f)
+
+    def save(self):
+        with atomic_write(self.state_path) as tmp_path:
+            with open(tmp_path, "w") as f:
+                json.dump(self.state, f, indent=2, sort_keys=True)
+
+    def submit(self, key, create_task, rerun=False):
+        """
+        Queue an export task unless it completed in a previous run, or
+        track the task started by a previous run if it is still active.
+
+        Args:
+            key (str): Unique name of the export, e.g. the file name prefix.
+            create_task (callable): Function returning a new, not started task.
+            rerun (bool): Queue the task even if it completed in a previous run.
+
+        Returns:
+            bool: True if the task was queued or is tracked.
+        """
+        previous = self.state.get(key, {})
+        if not rerun and previous.get("state") == COMPLETED:
+            logger.info(f"Export {key} already completed, skipping")
+            return False
+
+        if (
+            not rerun
+            and self.task_status is not None
+            and previous.get("state") in ACTIVE_STATES
+            and previous.get("task_id")
+        ):
+            task = AttachedTask(previous["task_id"], self.task_status)
+            self.running[key] = (task, create_task)
+            logger.info(f"Export {key} started by a previous run, polling task {task.id}")
+            return True
+
+        self.state[key] = {"state": PENDING, "attempts": 0, "task_id": None, "error": None}
+        self.queue.append((key, create_task))
+        return True
+
+    def _start(self, key, create_task):
+        task = create_task()
+        task.start()
+        self.running[key] = (task, create_task)
+        self.state[key]["attempts"] += 1
+        self.state[key]["task_id"] = getattr(task, "id", None)
+        self.state[key]["state"] = "READY"
+        logger.info(f"Started export {key} (attempt {self.state[key]['attempts']})")
+
+    def _poll(self):
+        for key, (task, create_task) in list(self.running.items()):
+            try:
+                status = with_retries(task.status, retries=self.status_retries)
+            except Exception:
+                logger.exception(f"Could not get the status of export {key}, polling it again later")
+                continue
+            state = status.get("state")
+            self.state[key]["state"] = state
+            if state not in FINISHED_STATES:
+                continue
+
+            del self.running[key]
+            if state == COMPLETED:
+                logger.info(f"Export {key} completed")
+            elif self.state[key]["attempts"] <= self.max_retries:
+                logger.warning(f"Export {key} {state}: {status.get('error_message')}, retrying")
+                self.queue.append((key, create_task))
+            else:
+                self.state[key]["error"] = status.get("error_message")
+                logger.error(f"Export {key} {state}: {status.get('error_message')}")
+
+    def run(self):
+        """
+        Start queued tasks and poll them until all have finished.
+
+        Returns:
+            dict: Export key to final task state for this run's tasks.
+        """
+        keys = [key for key, _ in self.queue] + list(self.running)
+        while self.queue or self.running:
+            while self.queue and len(self.running) < self.max_in_flight:
+                key, create_task = self.queue.pop(0)
+                try:
+                    self._start(key, create_task)
+                except Exception as e:
+                    self.state[key]["state"] = FAILED
+                    self.state[key]["error"] = str(e)
+                    logger.exception(f"Failed to start export {key}")
+            self.save()
+
+            if self.running:
+                time.sleep(self.poll_interval)
+                self._poll()
+                self.save()
+
+        return {key: self.state[key]["state"] for key in keys}
+
+
+class LocalTask:
+    """
+    Local stand-in for an ee.batch.Task that completes after a number of
+    status polls. Tasks whose description is in fail_descriptions fail
+    the first time they run.
+    """
+
+    _ids = itertools.count()
+
+    def __init__(self, config, polls_to_finish=1, fail_descriptions=None):
+        self.config = config
+        self.id = f"LOCAL{next(self._ids):08d}"
+        self.polls_to_finish = polls_to_finish
+        self.fail_descriptions = fail_descriptions if fail_descriptions is not None else []
+        self.polls = 0
+        self.started = False
+
+    def start(self):
+        self.started = True
+
+    def status(self):
+        if not self.started:
+            return {"id": self.id, "state": "UNSUBMITTED"}
+        self.polls += 1
+        if self.polls < self.polls_to_finish:
+            return {"id": self.id, "state": "RUNNING"}
+        description = self.config.get("description")
+        if description in self.fail_descriptions:
+            # Fail only once so that retries can succeed
+            self.fail_descriptions.remove(description)
+            return {"id": self.id, "state": FAILED, "error_message": "Local task failure"}
+        return {"id": self.id, "state": COMPLETED}
+
+
+class LocalBatch:
+    """
+    Local stand-in for the ee.batch module, to test and benchmark the
+    ExportScheduler without Earth Engine. Use it in place of ee.batch, e.g.
+    LocalBatch().Export.image.toCloudStorage(image, description="x", ...).
+
+    Args:
+        polls_to_finish (int): Number of status polls before a task finishes.
+        fail_descriptions (list): Descriptions of tasks that fail once.
+    """
+
+    def __init__(self, polls_to_finish=1, fail_descriptions=()):
+        self.polls_to_finish = polls_to_finish
+        self.fail_descriptions = list(fail_descriptions)
+        self.tasks = []
+        batch = self
+
+        class _Image:
+            @staticmethod
+            def toCloudStorage(image, **config):
+                task = LocalTask(
+                    config,
+                    polls_to_finish=batch.polls_to_finish,
+                    fail_descriptions=batch.fail_descriptions,
+                )
+                batch.tasks.append(task)
+                return task
+
+        class _Export:
+            image = _Image
+
+        self.Export = _Export
+
+    def task_status(self, task_id):
+        """
+        Get the status of a task from its id, for ExportScheduler's
+        task_status. Tasks of a previous run are unknown and reported as
+        completed.
+        """
+        for task in self.tasks:
+            if task.id == task_id:
+                return task.status()
+        return {"id": task_id, "state": COMPLETED}
@@ -1,9 +1,23 @@
+import io
+import hashlib
 import os
+import time
+import random
+import shutil
+import logging
+import requests
 import pandas as pd
 
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
 def table_floods_ems(
     event_start_date: str = "2014-05-01", 
-    ems_web_page: str = "https://poc-d8.lolandese.site/search-activations"
+    ems_web_page: str = "https://poc-d8.lolandese.site/search-activations",
+    session: requests.Session = None,
+    timeout: float = 60,
     ) -> pd.DataFrame:
     """
     Adapted from https://github.com/spaceml-org/ml4floods/blob/main/ml4floods/data/copernicusEMS/activations.py#L47
@@ -15,12 +29,19 @@ def table_floods_ems(
     Args:
       event_start_date (str): Date to retrieve EMS events from. 
       ems_web_page (str): URL of web page / table to download.
+      session (requests.Session): Session to download the web page with.
+      timeout (float): Timeout in seconds for connecting and reading. Use
+        with_retries to retry the request when it times out.
 
     Returns:
       A pandas.DataFrame of Flood and Storm events.
 
     """
-    tables = pd.read_html(ems_web_page)[0]
+    if session is None:
+        session = requests.Session()
+    r = session.get(ems_web_page, timeout=timeout)
+    r.raise_for_status()
+    tables = pd.read_html(io.StringIO(r.text))[0]
     tables_floods = tables[(tables.Type == "Flood") | (tables.Type == "Storm")]
     tables_floods = tables_floods[tables_floods["Act. Date"] >= event_start_date]
     tables_floods = tables_floods.reset_index()[
@@ -32,4 +53,140 @@ def table_floods_ems(
         axis=1,
     )
 
-    return tables_floods.set_index("Code")
\ No newline at end of file
+    return tables_floods.set_index("Code")
+
+
+def diff_activations(previous, current):
+    """
+    Compare two tables of EMS activations from table_floods_ems.
+
+    Args:
+      previous (pd.DataFrame): Table from the last sync, indexed by Code.
+      current (pd.DataFrame): Table fetched now, indexed by Code.
+
+    Returns:
+      A pandas.DataFrame indexed by Code with a Change column that is
+      "new", "changed" or "removed". Unchanged activations are left out.
+    """
+    previous = previous[~previous.index.duplicated()]
+    current = current[~current.index.duplicated()]
+
+    new = current.index.difference(previous.index)
+    removed = previous.index.difference(current.index)
+
+    common = current.index.intersection(previous.index)
+    columns = current.columns.intersection(previous.columns)
+    before = previous.loc[common, columns].astype(str)
+    after = current.loc[common, columns].astype(str)
+    changed = common[(before != after).any(axis=1).to_numpy()]
+
+    delta = pd.concat(
+        [
+            pd.Series("new", index=new),
+            pd.Series("changed", index=changed),
+            pd.Series("removed", index=removed),
+        ]
+    )
+
+    return delta.rename_axis("Code").to_frame("Change")
+
+
+@contextmanager
+def atomic_write(path):
+    """
+    Yield a temporary path in the same folder as path and move it to path
+    only if the block completes, so readers never see a partially written
+    file. The temporary name starts with a dot so dataset readers skip it.
+
+    Args:
+      path (str): Final path of the file.
+    """
+    folder, name = os.path.split(path)
+    tmp_path = os.path.join(folder, f".{name}.{os.getpid()}.tmp")
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def link_or_copy(src, dst):
+    """
+    Hard link src to dst, or copy it if a link cannot be made
+    (e.g. across file systems). An existing dst is replaced.
+
+    Args:
+      src (str): Path to the existing file.
+      dst (str): Path of the link or copy.
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy(src, dst)
+
+
+def memory_aware_workers(memory_per_worker_mb, max_workers=None):
+    """
+    Get a number of worker processes that fits in the available memory.
+
+    Args:
+      memory_per_worker_mb (float): Peak memory of one worker in MB.
+      max_workers (int): Upper bound on the number of workers. Defaults to
+        the number of CPUs.
+
+    Returns:
+      int: Number of workers, at least 1.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    try:
+        available = os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return max_workers
+    fits = int(available // (memory_per_worker_mb * 2 ** 20))
+    return max(1, min(max_workers, fits))
+
+
+def file_digest(path, chunk_size=2 ** 20):
+    """
+    Hash the content of a file, reading it chunk_size bytes at a time.
+
+    Args:
+      path (str): Path to the file.
+      chunk_size (int): Number of bytes read at a time.
+
+    Returns:
+      str: Hex SHA-1 digest of the file.
+    """
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def with_retries(func, *args, retries=3, backoff=1.0, **kwargs):
+    """
+    Call a function and retry it with exponential backoff when it raises.
+
+    Args:
+        func (callable): Function to call.
+        retries (int): Number of retries after the first attempt.
+        backoff (float): Base delay in seconds, doubled after each failed attempt.
+
+    Returns:
+        The return value of func.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            if attempt == retries:
+                raise
+            delay = backoff * 2 ** attempt + random.uniform(0, backoff)
+            logger.warning(
+                f"{getattr(func, '__name__', func)} failed (attempt {attempt + 1}), retrying in {delay:.1f}s"
+            )
+            time.sleep(delay)
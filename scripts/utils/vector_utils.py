@@ -0,0 +1,372 @@
+import os
+import fnmatch
+import zipfile
+import datetime
+import traceback
+import multiprocessing
+import numpy as np
+import geopandas as gpd
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from shapely.ops import unary_union
+from ml4floods.data.config import RENAME_SATELLITE
+from ml4floods.data.copernicusEMS import activations
+from utils import floodmap_store
+from utils import product_index as index_helpers
+from utils import country_utils as country_helpers
+
+
+def vsizip_path(zip_path, member=""):
+    """
+    Get the GDAL /vsizip/ path of a zip file or of a file inside it.
+
+    Args:
+        zip_path (str): Path to the zip file.
+        member (str): Path of a file inside the zip file.
+
+    Returns:
+        str: Path that GDAL (and geopandas) can read without extracting the zip file.
+    """
+    path = "/vsizip/" + os.path.abspath(zip_path)
+    if member:
+        path = path + "/" + member
+    return path
+
+
+def _glob_zip(members, folder, pattern):
+    """
+    Counterpart of glob.glob(os.path.join(folder, pattern)) for the members
+    of a zip file.
+    """
+    return [
+        m
+        for m in members
+        if os.path.dirname(m) == folder and fnmatch.fnmatchcase(os.path.basename(m), pattern)
+    ]
+
+
+def _file_in_zip(zip_path, members, folder, pattern):
+    """
+    Counterpart of activations.is_file_in_directory for the members of a
+    zip file. Returns the /vsizip/ path of the only match of pattern.
+    """
+    matches = _glob_zip(members, folder, pattern)
+    if len(matches) == 1:
+        return vsizip_path(zip_path, matches[0])
+    return None
+
+
+def register_copernicusems_zip(zip_path, code_date, verbose=False):
+    """
+    Register an EMS vector product read directly inside its zip file.
+
+    Port of activations.filter_register_copernicusems for zip files that
+    are not extracted. The files are located from the zip file's table of
+    contents instead of globbing a folder and read through GDAL's /vsizip/
+    virtual filesystem. The validation of the source, observed event and
+    hydrography files and the fields of the metadata are those of
+    ml4floods, so the metadata does not depend on extract_zips.
+
+    Args:
+        zip_path (str): Path to the downloaded zip file.
+        code_date (str): Activation date of the EMSR code.
+        verbose (bool): Print why a product is not registered.
+
+    Returns:
+        dict: Metadata of the vector product, or None if there are
+        inconsistencies in the product.
+    """
+    with zipfile.ZipFile(zip_path) as z:
+        members = z.namelist()
+
+    # unzip_copernicus_ems extracts a product to a folder that
+    # filter_register_copernicusems globs, so only files at the root of
+    # the zip file are part of the product
+    folder = ""
+
+    # Fetch source files needed to generate floodmap - source, observed event, area of interest
+    source_file = _file_in_zip(zip_path, members, folder, "*_source*.dbf")
+    if not source_file:
+        return None
+
+    observed_event_file = _file_in_zip(zip_path, members, folder, "*_observed*.shp")
+    if not observed_event_file:
+        return None
+
+    area_of_interest_file = _file_in_zip(zip_path, members, folder, "*_area*.shp")
+    if not area_of_interest_file:
+        return None
+
+    pd_source = activations.load_source_file(source_file, verbose=verbose)
+    if pd_source is None:
+        return None
+
+    product_name = os.path.basename(observed_event_file).split("_observed")[0]
+    ems_code, aoi_code = product_name.split("_")[0:2]
+
+    # Filter content of shapefile
+    pd_geo = activations.load_observed_event_file(observed_event_file, verbose=verbose)
+    if pd_geo is None:
+        return None
+
+    # Dates and satellite of the post-event sources of the observed event
+    valid_srd_fields_bool = pd_source.src_id.isin(np.unique(pd_geo.dmg_src_id))
+    if not valid_srd_fields_bool.any():
+        return None
+
+    post_event = valid_srd_fields_bool & (pd_source.eventphase == "Post-event")
+    min_date_post_event = min(pd_source.loc[post_event, "date"])
+    max_date_post_event = max(pd_source.loc[post_event, "date"])
+
+    satellite_post_event = pd_source.loc[
+        (pd_source.eventphase == "Post-event") & (pd_source.date == max_date_post_event),
+        "source_nam",
+    ].iloc[0]
+
+    date_ems_code = datetime.datetime.strptime(code_date, "%Y-%m-%d").replace(
+        tzinfo=datetime.timezone.utc
+    )
+
+    if not activations.post_event_date_difference_is_ok(
+        min_date_post_event, date_ems_code, max_date_post_event, verbose
+    ):
+        return None
+
+    # Check if pre-event date precedes post-event date
+    content_pre_event = {}
+    if np.any(pd_source.eventphase == "Pre-event"):
+        date_pre_event = max(np.array(pd_source[pd_source.eventphase == "Pre-event"]["date"]))
+        satellite_pre_event = np.array(
+            pd_source[
+                (pd_source.eventphase == "Pre-event") & (pd_source.date == date_pre_event)
+            ]["source_nam"]
+        )[0]
+
+        content_pre_event["satellite_pre_event"] = satellite_pre_event
+        content_pre_event["timestamp_pre_event"] = date_pre_event
+        if (min_date_post_event - date_pre_event).days < 0 and verbose:
+            return None
+
+    if not isinstance(satellite_post_event, str) and verbose:
+        return None
+
+    satellite_post_event = RENAME_SATELLITE.get(satellite_post_event, satellite_post_event)
+
+    area_of_interest = gpd.read_file(area_of_interest_file)
+    if area_of_interest.crs is None:
+        return None
+
+    area_of_interest_crs = str(area_of_interest.crs)
+    if area_of_interest_crs.lower() != "epsg:4326":
+        area_of_interest.to_crs(crs="epsg:4326", inplace=True)
+
+    # Save pol of area of interest in epsg:4326 (lat/lng)
+    area_of_interest_pol = unary_union(area_of_interest["geometry"])
+
+    if "obj_desc" in pd_geo:
+        event_type = np.unique(pd_geo.obj_desc)[0]
+    else:
+        event_type = "NaN"
+
+    register = {
+        "event id": product_name,
+        "layer name": os.path.basename(os.path.splitext(observed_event_file)[0]),
+        "event type": event_type,
+        "satellite date": max_date_post_event,
+        "country": "NaN",
+        "satellite": satellite_post_event,
+        "bounding box": activations.get_bbox(pd_geo),
+        "reference system": area_of_interest_crs,
+        "abstract": "NaN",
+        "purpose": "NaN",
+        "source": "CopernicusEMS",
+        "area_of_interest_polygon": area_of_interest_pol,
+        # CopernicusEMS specific fields
+        "observed_event_file": os.path.basename(observed_event_file),
+        "area_of_interest_file": os.path.basename(area_of_interest_file),
+        "ems_code": ems_code,
+        "aoi_code": aoi_code,
+        "date_ems_code": date_ems_code,
+        # Folder of the product files inside the zip file
+        "folder_files": vsizip_path(zip_path),
+    }
+
+    register.update(content_pre_event)
+
+    # Add hydrography polygons and hydrography lines
+    for key, name_possibilities in [
+        ("hydrology_file", ["_hydrographyA_", "_hydrography_a", "_hydrography_p"]),
+        ("hydrology_file_l", ["_hydrographyL_", "_hydrography_l"]),
+    ]:
+        for name_pos in name_possibilities:
+            hydrology_files = _glob_zip(members, folder, f"*{name_pos}*.shp")
+            if len(hydrology_files) == 1:
+                if not activations._check_hydro_ok(vsizip_path(zip_path, hydrology_files[0])):
+                    return None
+                register[key] = os.path.basename(hydrology_files[0])
+
+    return register
+
+
+def process_vector_product(unzip_folder, code_date, folder_store, filter_tropics=False):
+    """
+    Generate metadata and a floodmap for an unzipped EMS vector product.
+
+    The metadata and the floodmap are written atomically, so a failed or
+    interrupted worker never leaves partially written outputs behind.
+    Zip files that were not extracted are read in place through /vsizip/.
+
+    Args:
+        unzip_folder (str): Folder of the unzipped vector product, or the zip file.
+        code_date (str): Activation date of the EMSR code.
+        folder_store (str): Folder of the GeoParquet floodmap store.
+        filter_tropics (bool): Skip the product if its AOI polygon is
+            outside the tropics.
+
+    Returns:
+        tuple: (unzip_folder, status, error) where status is "processed",
+        "skipped" if the product does not follow the expected format,
+        "outside_tropics" if filtered out by its AOI polygon or "failed"
+        and error is the formatted traceback of a failure.
+    """
+    try:
+        # Check that all the .shp files follow the expected conventions
+        # with respect to timestamp and data availability.
+        # Get AOI, hydrography, and observed event data from the zip file folder.
+        if unzip_folder.endswith(".zip"):
+            metadata_floodmap = register_copernicusems_zip(unzip_folder, code_date)
+            folder_files = metadata_floodmap and metadata_floodmap["folder_files"]
+        else:
+            metadata_floodmap = activations.filter_register_copernicusems(
+                unzip_folder, code_date
+            )
+            folder_files = unzip_folder
+        if metadata_floodmap is None:
+            return unzip_folder, "skipped", None
+        metadata_floodmap.setdefault("folder_files", folder_files)
+        if filter_tropics and not country_helpers.in_tropics(
+            [metadata_floodmap["area_of_interest_polygon"]]
+        )[0]:
+            return unzip_folder, "outside_tropics", None
+
+        # Process the .shp files' AOI, hydrography, and observed event
+        # into a single geopandas.GeoDataFrame object using generate_floodmap.
+        floodmap = activations.generate_floodmap(
+            metadata_floodmap, folder_files=folder_files
+        )
+
+        name = os.path.splitext(os.path.basename(unzip_folder.rstrip("/")))[0]
+
+        # Save floodmap and typed metadata to the GeoParquet store
+        floodmap_store.write_floodmap(folder_store, name, floodmap, metadata_floodmap)
+
+        return unzip_folder, "processed", None
+    except Exception:
+        return unzip_folder, "failed", traceback.format_exc()
+
+
+def _run_vector_jobs(jobs, folder_store, max_workers, filter_tropics):
+    """
+    Run process_vector_product for jobs in a pool of spawned processes.
+
+    At most max_workers jobs are submitted at once, so the jobs lost when a
+    worker dies are the ones that were running, not the queued ones.
+
+    Yields:
+        tuple: (index of the job, result) for each job as it completes.
+        The result is None if the job was running when a worker died and
+        broke the pool. Jobs not yet submitted when the pool broke are not
+        yielded.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    queue = list(jobs)
+    mp_context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context) as pool:
+        futures = {}
+        broken = False
+        while futures or (queue and not broken):
+            while queue and not broken and len(futures) < max_workers:
+                k = queue.pop(0)
+                unzip_folder, code_date = jobs[k]
+                future = pool.submit(
+                    process_vector_product, unzip_folder, code_date, folder_store, filter_tropics
+                )
+                futures[future] = k
+
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                k = futures.pop(future)
+                try:
+                    yield k, future.result()
+                except BrokenProcessPool:
+                    broken = True
+                    yield k, None
+                except Exception:
+                    yield k, (jobs[k][0], "failed", traceback.format_exc())
+
+
+def process_vector_products(
+    jobs, folder_store, max_workers=None, filter_tropics=False, max_solo_runs=10
+):
+    """
+    Run process_vector_product for many unzipped vector products across a
+    pool of processes. Generating floodmaps reads shapefiles and unions
+    geometries, which is CPU bound.
+
+    Workers are spawned, so they do not inherit the threads or open
+    connections of this process. A worker that dies (e.g. in GDAL) breaks
+    the pool and loses the jobs that were running. The lost jobs are run
+    again in a new pool with the jobs not started yet, and only a job lost
+    a second time is run alone in its own process, so only the product
+    that kills a worker is reported as failed. At most max_solo_runs jobs
+    are run alone; further jobs lost twice are reported as failed.
+
+    Args:
+        jobs (list): (unzip_folder, code_date) tuples.
+        folder_store (str): Folder of the GeoParquet floodmap store.
+        max_workers (int): Number of processes. Products are processed in
+            this process if max_workers is 1.
+        filter_tropics (bool): Skip products whose AOI polygon is outside the tropics.
+        max_solo_runs (int): Maximum number of jobs run alone.
+
+    Yields:
+        tuple: (unzip_folder, status, error) for each job as it completes.
+    """
+    if max_workers == 1:
+        for unzip_folder, code_date in jobs:
+            yield process_vector_product(unzip_folder, code_date, folder_store, filter_tropics)
+        return
+
+    pending = dict(enumerate(jobs))
+    lost = {k: 0 for k in pending}
+    solo_runs = 0
+    while pending:
+        shared = {k: job for k, job in pending.items() if lost[k] < 2}
+        alone = {k: job for k, job in pending.items() if lost[k] >= 2}
+        pending = {}
+
+        finished = set()
+        for k, result in _run_vector_jobs(shared, folder_store, max_workers, filter_tropics):
+            finished.add(k)
+            if result is None:
+                lost[k] += 1
+                pending[k] = shared[k]
+            else:
+                yield result
+        # Jobs not started before the pool broke are not counted as lost
+        pending.update({k: job for k, job in shared.items() if k not in finished})
+
+        for k, job in alone.items():
+            if solo_runs >= max_solo_runs:
+                yield (
+                    job[0],
+                    "failed",
+                    "worker process died twice while processing the product with others",
+                )
+                continue
+            solo_runs += 1
+            for _, result in _run_vector_jobs({k: job}, folder_store, 1, filter_tropics):
+                if result is None:
+                    result = (job[0], "failed", "worker process died while processing the product")
+                yield result